@@ -6,6 +6,7 @@ from nonebot.plugin import PluginMetadata
 
 from .config import Config
 from .db import create_session as create_session
+from .db import get_event_session as get_event_session
 from .db import get_session as get_session
 from .plugin import PluginData as PluginData
 from .plugin import get_plugin_data as get_plugin_data
@@ -0,0 +1,161 @@
+"""批量写入
+
+逐条调用 `session.add` 或 `session.merge` 时每一行都需要与数据库交互一次
+批量写入将数据分块，每块通过一次 executemany 写入
+"""
+
+from collections.abc import Iterable, Mapping, Sequence
+from typing import Any, Optional
+
+from sqlalchemy import Insert, inspect, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import DeclarativeBase, Mapper
+
+from .config import plugin_config
+
+
+def _get_column_keys(mapper: Mapper) -> dict[str, str]:
+    """模型属性名与列名的对应关系"""
+    return {attr.key: attr.columns[0].key for attr in mapper.column_attrs}
+
+
+def _to_column_rows(
+    mapper: Mapper, rows: Iterable[Mapping[str, Any]]
+) -> list[dict[str, Any]]:
+    """将以模型属性名为键的数据转换为以列名为键"""
+    column_keys = _get_column_keys(mapper)
+    return [
+        {column_keys.get(key, key): value for key, value in row.items()} for row in rows
+    ]
+
+
+def _chunks(rows: list[dict[str, Any]], chunk_size: Optional[int]):
+    chunk_size = chunk_size or plugin_config.datastore_bulk_chunk_size
+    if chunk_size <= 0:
+        raise ValueError("chunk_size 必须大于 0")
+    for index in range(0, len(rows), chunk_size):
+        yield rows[index : index + chunk_size]
+
+
+async def _execute_chunks(
+    session: AsyncSession,
+    statement: Insert,
+    mapper: Mapper,
+    rows: list[dict[str, Any]],
+    chunk_size: Optional[int],
+) -> int:
+    count = 0
+    for chunk in _chunks(rows, chunk_size):
+        result = await session.execute(
+            statement, chunk, bind_arguments={"mapper": mapper}
+        )
+        # 部分驱动无法获取 executemany 的影响行数
+        count += result.rowcount if result.rowcount >= 0 else len(chunk)  # type: ignore
+    return count
+
+
+async def bulk_insert(
+    session: AsyncSession,
+    model: type[DeclarativeBase],
+    rows: Iterable[Mapping[str, Any]],
+    chunk_size: Optional[int] = None,
+) -> int:
+    """批量插入数据
+
+    `rows` 中每一项为以模型属性名为键的字典
+    每 `chunk_size` 行通过一次 executemany 插入，默认为 `datastore_bulk_chunk_size`
+    不会自动提交，返回插入的行数
+    """
+    mapper = inspect(model)
+    column_rows = _to_column_rows(mapper, rows)
+    if not column_rows:
+        return 0
+    return await _execute_chunks(
+        session, insert(mapper.local_table), mapper, column_rows, chunk_size
+    )
+
+
+def _get_upsert_statement(
+    dialect_name: str,
+    mapper: Mapper,
+    index_elements: Sequence[str],
+    update_columns: Sequence[str],
+    increment_columns: Sequence[str] = (),
+) -> Insert:
+    table = mapper.local_table
+
+    def _value(name: str, new_value):
+        # 累加的列在原值上加上新值
+        if name in increment_columns:
+            return table.c[name] + new_value
+        return new_value
+
+    if dialect_name in ("sqlite", "postgresql"):
+        if dialect_name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        statement = dialect_insert(table)
+        if not update_columns:
+            return statement.on_conflict_do_nothing(index_elements=index_elements)
+        return statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={
+                name: _value(name, statement.excluded[name]) for name in update_columns
+            },
+        )
+
+    if dialect_name in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+        statement = dialect_insert(table)
+        # 没有需要更新的列时，将主键更新为自身，相当于忽略冲突
+        update_columns = update_columns or index_elements[:1]
+        return statement.on_duplicate_key_update(
+            {name: _value(name, statement.inserted[name]) for name in update_columns}
+        )
+
+    raise ValueError(f"不支持批量更新的数据库: {dialect_name}")
+
+
+async def bulk_upsert(
+    session: AsyncSession,
+    model: type[DeclarativeBase],
+    rows: Iterable[Mapping[str, Any]],
+    index_elements: Optional[Sequence[str]] = None,
+    update_columns: Optional[Sequence[str]] = None,
+    chunk_size: Optional[int] = None,
+    increment_columns: Sequence[str] = (),
+) -> int:
+    """批量插入或更新数据
+
+    SQLite 与 PostgreSQL 使用 `ON CONFLICT`，MySQL 使用 `ON DUPLICATE KEY`
+    `index_elements` 为判断冲突的列，默认为主键
+    `update_columns` 为冲突时需要更新的列，默认为数据中除冲突列外的所有列
+    `increment_columns` 为冲突时在原值上加上新值的列，需同时为需要更新的列
+    列名均为模型属性名，不会自动提交，返回数据库报告的影响行数
+
+    MySQL 中更新的行会被计为 2 行
+    """
+    mapper = inspect(model)
+    column_keys = _get_column_keys(mapper)
+    column_rows = _to_column_rows(mapper, rows)
+    if not column_rows:
+        return 0
+
+    if index_elements is None:
+        conflict_columns = [column.key for column in mapper.local_table.primary_key]
+    else:
+        conflict_columns = [column_keys.get(key, key) for key in index_elements]
+    if update_columns is None:
+        updates = [key for key in column_rows[0] if key not in conflict_columns]
+    else:
+        updates = [column_keys.get(key, key) for key in update_columns]
+    increments = [column_keys.get(key, key) for key in increment_columns]
+
+    bind = session.get_bind(mapper=mapper)
+    statement = _get_upsert_statement(
+        bind.dialect.name, mapper, conflict_columns, updates, increments
+    )
+    return await _execute_chunks(session, statement, mapper, column_rows, chunk_size)
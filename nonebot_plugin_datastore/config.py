@@ -1,7 +1,7 @@
 """配置"""
 
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 from nonebot import get_plugin_config
 from nonebot_plugin_localstore import get_cache_dir, get_config_dir, get_data_dir
@@ -19,10 +19,99 @@ class Config(BaseModel):
 
     默认使用 SQLite
     """
+    datastore_read_database_url: Optional[str] = None
+    """只读数据库连接字符串
+
+    `get_session(readonly=True)` 与 `create_session(readonly=True)` 使用
+    """
+    datastore_plugin_database_urls: dict[str, str] = {}
+    """插件单独使用的数据库连接字符串
+
+    键为插件名，值为数据库连接字符串或 SQLite 数据库文件路径
+    相对路径会放置在数据目录下
+    """
     datastore_enable_database: bool = True
     datastore_database_echo: bool = False
+    datastore_enable_metrics: bool = False
+    """是否统计连接池与查询的指标"""
+    datastore_metrics_dump_interval: float = 60
+    """保存指标的间隔，单位为秒
+
+    保存至缓存目录，供命令行读取，小于等于 0 时只在关闭时保存
+    """
+    datastore_slow_query_threshold: Optional[float] = None
+    """慢查询阈值，单位为秒
+
+    执行时间超过阈值的语句会记录至数据目录下的慢查询日志，不设置则不记录
+    """
     datastore_engine_options: dict[str, Any] = {}
+    datastore_session_options: dict[str, Any] = {}
+    """创建 session 时的选项
+
+    支持 expire_on_commit、autoflush 与 info
+    """
+    datastore_plugin_session_options: dict[str, dict[str, Any]] = {}
+    """插件单独使用的 session 选项
+
+    键为插件名，值会覆盖 `datastore_session_options` 中的同名选项
+    """
+    datastore_sqlite_profile: Optional[str] = None
+    """SQLite 配置方案
+
+    可选值: performance
+    """
+    datastore_sqlite_pragmas: dict[str, Any] = {}
+    """连接 SQLite 时执行的 PRAGMA，会覆盖配置方案中的同名设置"""
+    datastore_sqlite_write_queue: bool = False
+    """使用 SQLite 时，所有写入事务都通过同一个写入连接按顺序执行"""
     datastore_config_provider: str = "~json"
+    datastore_bulk_chunk_size: int = 500
+    """批量写入时每次 executemany 的行数"""
+    datastore_retry_attempts: int = 5
+    """`run_transaction` 遇到数据库繁忙或被锁定时最多尝试的次数"""
+    datastore_retry_base_delay: float = 0.05
+    """第一次重试前最多等待的时间，单位为秒，之后每次翻倍"""
+    datastore_retry_max_delay: float = 1.0
+    """重试前最多等待的时间，单位为秒"""
+    datastore_group_commit_interval: float = 0.01
+    """合并提交时等待更多操作的时间，单位为秒"""
+    datastore_group_commit_max_operations: int = 100
+    """合并提交时一个事务中最多包含的操作数，达到后立即提交"""
+    datastore_counter_flush_interval: float = 5
+    """计数器将内存中的计数写入数据库的间隔，单位为秒"""
+    datastore_backfill_chunk_size: int = 1000
+    """迁移中分批回填数据时每批的行数"""
+    datastore_migration_concurrency: int = 1
+    """启动时同时执行 `pre_db_init` 函数的插件数量
+
+    只有 `pre_db_init` 函数会同时执行，迁移本身始终逐个运行
+    """
+    datastore_migration_batch: Optional[str] = None
+    """在同一个连接中初始化所有插件的数据库
+
+    可选值: transaction, savepoint，不设置则每个插件单独打开连接
+    """
+    datastore_migration_fast_path: bool = False
+    """启动时跳过数据库已是最新版本的插件"""
+    datastore_background_migration: bool = False
+    """在后台初始化数据库，不阻塞机器人启动
+
+    未初始化完成的插件在查询时会等待该插件初始化完成
+    """
+    datastore_warmup: bool = False
+    """数据库初始化完成后预热数据库
+
+    配置所有模型的 mapper，并为每个数据库引擎预先打开连接
+    """
+    datastore_warmup_connections: int = 1
+    """预热时每个数据库引擎打开的连接数，不会超过连接池的大小"""
+    datastore_post_db_init_concurrency: int = 1
+    """同时执行数据库初始化后执行的函数的数量
+
+    有依赖关系的函数始终在依赖的函数执行完之后执行
+    """
+    datastore_shutdown_timeout: float = 10
+    """关闭时等待正在进行的事务完成的最长时间，单位为秒"""
 
     @model_validator(mode="before")
     def set_defaults(cls, values: dict):
@@ -51,6 +140,17 @@ class Config(BaseModel):
                 f"sqlite+aiosqlite:///{values['datastore_data_dir'] / 'data.db'}"
             )
 
+        # 将插件单独使用的 SQLite 数据库文件路径转换为连接字符串
+        if isinstance(urls := values.get("datastore_plugin_database_urls"), dict):
+            values["datastore_plugin_database_urls"] = {
+                name: (
+                    url
+                    if "://" in url
+                    else f"sqlite+aiosqlite:///{values['datastore_data_dir'] / url}"
+                )
+                for name, url in urls.items()
+            }
+
         return values
 
 
@@ -0,0 +1,174 @@
+"""计数器
+
+先在内存中累加计数，定时批量写入数据库，避免每次计数都需要读取并写入数据库
+"""
+
+import asyncio
+from typing import Any, Optional
+
+from nonebot.log import logger
+from sqlalchemy import inspect
+from sqlalchemy.orm import DeclarativeBase
+
+from .bulk import bulk_upsert
+from .config import plugin_config
+from .db import create_session, on_db_shutdown
+
+_counters: list["Counter"] = []
+
+
+class Counter:
+    """计数器
+
+    `model` 的主键为计数的键，`value` 为存放计数的列
+    计数会先累加在内存中，每 `flush_interval` 秒写入一次数据库
+    """
+
+    def __init__(
+        self,
+        model: type[DeclarativeBase],
+        value: str = "count",
+        flush_interval: Optional[float] = None,
+    ) -> None:
+        self.model = model
+        self.value = value
+        self.flush_interval = (
+            plugin_config.datastore_counter_flush_interval
+            if flush_interval is None
+            else flush_interval
+        )
+
+        mapper = inspect(model)
+        self.keys = [
+            mapper.get_property_by_column(column).key for column in mapper.primary_key
+        ]
+        """计数的键，即模型主键的属性名"""
+
+        self._pending: dict[tuple, int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flushes = 0
+        """开始写入的次数，用于判断获取计数期间是否有新的写入"""
+
+        _counters.append(self)
+
+    def _get_lock(self) -> asyncio.Lock:
+        """获取当前事件循环中的锁
+
+        实例通常在导入插件时创建，此时驱动器的事件循环还没有运行
+        Python 3.9 的锁会绑定创建时的事件循环，所以等到第一次使用时再创建
+        """
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _get_key(self, keys: dict[str, Any]) -> tuple:
+        if set(keys) != set(self.keys):
+            raise ValueError(f"计数的键应为 {', '.join(self.keys)}")
+        return tuple(keys[key] for key in self.keys)
+
+    def increment(self, amount: int = 1, **keys: Any) -> None:
+        """增加计数
+
+        只在内存中累加，不会立即写入数据库
+        例: `counter.increment(group_id=1, user_id=2, day=date.today())`
+        """
+        key = self._get_key(keys)
+        self._pending[key] = self._pending.get(key, 0) + amount
+
+        if self._timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # 没有运行中的事件循环时，等待手动写入或关闭时写入
+                return
+            self._timer = loop.call_later(self.flush_interval, self._start_flush)
+
+    def pending(self, **keys: Any) -> int:
+        """尚未写入数据库的计数"""
+        return self._pending.get(self._get_key(keys), 0)
+
+    async def get(self, **keys: Any) -> int:
+        """获取计数
+
+        数据库中的计数加上尚未写入数据库的计数
+        """
+        key = self._get_key(keys)
+        while True:
+            # 等待正在进行的写入完成，只在锁内复制尚未写入的计数
+            async with self._get_lock():
+                pending = self._pending.get(key, 0)
+                flushes = self._flushes
+
+            async with create_session() as session:
+                instance = await session.get(self.model, key)
+                stored = getattr(instance, self.value) if instance else 0
+
+            # 查询期间开始了新的写入时，计数可能已经写入数据库，需要重新获取
+            if self._flushes == flushes:
+                return stored + pending
+
+    def _start_flush(self) -> None:
+        self._timer = None
+        task = asyncio.create_task(self._flush_periodically())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_periodically(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("写入计数失败，将在下次写入时重试")
+            if self._pending and self._timer is None:
+                loop = asyncio.get_running_loop()
+                self._timer = loop.call_later(self.flush_interval, self._start_flush)
+
+    async def flush(self) -> int:
+        """将内存中的计数写入数据库
+
+        返回写入的键的数量
+        """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        async with self._get_lock():
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            self._flushes += 1
+
+            rows = [
+                {**dict(zip(self.keys, key)), self.value: amount}
+                for key, amount in pending.items()
+            ]
+            try:
+                async with create_session() as session, session.begin():
+                    await bulk_upsert(
+                        session,
+                        self.model,
+                        rows,
+                        update_columns=[self.value],
+                        increment_columns=[self.value],
+                    )
+            except BaseException:
+                # 写入失败时将计数放回内存，等待下次写入
+                for key, amount in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + amount
+                raise
+            return len(rows)
+
+
+# 关闭数据库前写入所有尚未写入的计数
+@on_db_shutdown
+async def flush_counters() -> None:
+    """将所有计数器内存中的计数写入数据库"""
+    for counter in _counters:
+        try:
+            await counter.flush()
+        except Exception:
+            logger.exception(f"写入 {counter.model.__name__} 的计数失败")
@@ -1,37 +1,81 @@
 """数据库"""
 
-from collections.abc import AsyncGenerator
+import asyncio
+import functools
+import inspect
+import time
+import weakref
+from collections.abc import AsyncGenerator, AsyncIterator, Iterable
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+from graphlib import TopologicalSorter
 from pathlib import Path
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING, Any, Callable, Optional
 
 from nonebot import get_driver
+from nonebot.adapters import Event
 from nonebot.log import logger
+from nonebot.matcher import current_matcher
+from nonebot.message import event_postprocessor, run_postprocessor
 from nonebot.utils import is_coroutine_callable, run_sync
+from sqlalchemy import Delete, Insert, Update, event, text
 from sqlalchemy.engine import make_url
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import Session, configure_mappers
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.util.concurrency import await_only, in_greenlet
 
 from .config import plugin_config
+from .metrics import setup_engine_metrics, start_metrics_dump, stop_metrics_dump
+from .profile import StartupProfile, save_profile
+from .slow_query import setup_slow_query_log
+from .sqlite import get_sqlite_pragmas, setup_sqlite_pragmas
 from .utils import get_caller_plugin_name
+from .writer import WRITER_ENGINE_OPTIONS
 
 if TYPE_CHECKING:
     from sqlalchemy.ext.asyncio.engine import AsyncEngine
 
 
 _engine = None
+_writer_engine = None
+_read_engine = None
+_plugin_engines: dict[str, "AsyncEngine"] = {}
+
+_plugin_ready_events: dict[str, asyncio.Event] = {}
+_plugin_init_errors: dict[str, BaseException] = {}
+_migration_task: Optional[asyncio.Task] = None
+# 数据库初始化过程中的查询不需要等待插件就绪
+_in_db_init: ContextVar[bool] = ContextVar("datastore_in_db_init", default=False)
+
+# 正在进行事务的 Session，关闭时需要等待它们完成
+_active_sessions: "weakref.WeakSet[Session]" = weakref.WeakSet()
+_db_shutdown_funcs: list[Callable] = []
+# 每个事件共享的 session，键为事件的 id
+_event_sessions: dict[int, "EventSession"] = {}
+# 有事件响应器出现异常，需要回滚的事件
+_failed_events: set[int] = set()
 
 _pre_db_init_funcs: dict[str, list] = {}
 _post_db_init_funcs = []
+_post_db_init_dependencies: dict[Callable, list[Callable]] = {}
 
 
-def _make_engine() -> "AsyncEngine":
-    """创建数据库引擎"""
-    url = make_url(plugin_config.datastore_database_url)
-    if (
+def _make_engine(database_url: Optional[str] = None, **options) -> "AsyncEngine":
+    """创建数据库引擎
+
+    默认连接 `datastore_database_url`
+    `options` 会覆盖 `datastore_engine_options` 中的同名参数
+    """
+    database_url = database_url or plugin_config.datastore_database_url
+    url = make_url(database_url)
+    is_sqlite_file = (
         url.drivername.startswith("sqlite")
         and url.database is not None
         and url.database not in [":memory:", ""]
-    ):
+    )
+    if is_sqlite_file:
         # 创建数据文件夹，防止数据库创建失败
         database_path = Path(url.database)
         database_path.parent.mkdir(parents=True, exist_ok=True)
@@ -39,19 +83,224 @@ def _make_engine() -> "AsyncEngine":
     # 创建数据库引擎
     engine_options = {}
     engine_options.update(plugin_config.datastore_engine_options)
+    engine_options.update(options)
+    pragmas = get_sqlite_pragmas() if url.get_backend_name() == "sqlite" else {}
+    if pragmas and is_sqlite_file:
+        # aiosqlite 默认不保留连接，每次都需要重新执行 PRAGMA
+        # 缓存等设置也会随着连接关闭而失效，所以改为保留连接
+        engine_options.setdefault("poolclass", AsyncAdaptedQueuePool)
     engine_options.setdefault("echo", plugin_config.datastore_database_echo)
     engine_options.setdefault("echo_pool", plugin_config.datastore_database_echo)
-    logger.debug(f"数据库连接地址: {plugin_config.datastore_database_url}")
+    logger.debug(f"数据库连接地址: {database_url}")
     logger.debug(f"数据库引擎参数: {engine_options}")
-    return create_async_engine(url, **engine_options)
+    engine = create_async_engine(url, **engine_options)
+    if pragmas:
+        setup_sqlite_pragmas(engine, pragmas)
+    return engine
 
 
-def get_engine() -> "AsyncEngine":
-    if _engine is None:
+def _init_engines() -> None:
+    """创建所有数据库引擎
+
+    导入数据库驱动与创建连接池都需要时间，所以等到第一次使用时才创建
+    """
+    global _engine, _writer_engine, _read_engine, _plugin_engines
+
+    engine = _make_engine()
+    if plugin_config.datastore_sqlite_write_queue and engine.dialect.name == "sqlite":
+        _writer_engine = _make_engine(**WRITER_ENGINE_OPTIONS)
+    if plugin_config.datastore_read_database_url:
+        _read_engine = _make_engine(plugin_config.datastore_read_database_url)
+    _plugin_engines = {
+        name: _make_engine(url)
+        for name, url in plugin_config.datastore_plugin_database_urls.items()
+    }
+    _engine = engine
+
+    if plugin_config.datastore_enable_metrics:
+        for name, engine in get_engines().items():
+            setup_engine_metrics(engine, name)
+
+    if (threshold := plugin_config.datastore_slow_query_threshold) is not None:
+        for name, engine in get_engines().items():
+            setup_slow_query_log(engine, name, threshold)
+
+
+def get_engine(plugin_name: Optional[str] = None) -> "AsyncEngine":
+    """获取数据库引擎
+
+    如果插件单独设置了数据库，则返回该插件的数据库引擎
+    第一次调用时创建数据库引擎
+    """
+    if not plugin_config.datastore_enable_database:
         raise ValueError("数据库未启用")
+    if _engine is None:
+        _init_engines()
+    assert _engine is not None
+    if plugin_name is not None and plugin_name in _plugin_engines:
+        return _plugin_engines[plugin_name]
     return _engine
 
 
+def get_table_plugin_name(table) -> Optional[str]:
+    """获取表所属的插件名"""
+    metadata = getattr(table, "metadata", None)
+    if metadata is None:
+        return None
+    # 使用全局 registry 时，所有插件共用一个 metadata
+    # 需要通过 plugin_name_map 获取表对应的插件名
+    return metadata.info.get("name") or metadata.info.get("plugin_name_map", {}).get(
+        table.name
+    )
+
+
+def _get_plugin_name(mapper, clause) -> Optional[str]:
+    """获取 ORM 模型或语句所属的插件名"""
+    if mapper is not None:
+        table = mapper.persist_selectable
+    else:
+        table = getattr(clause, "table", None)
+    return get_table_plugin_name(table)
+
+
+def _get_plugin_engine(mapper, clause) -> Optional["AsyncEngine"]:
+    """获取 ORM 模型或语句所属插件单独使用的数据库引擎"""
+    if not _plugin_engines:
+        return None
+    plugin_name = _get_plugin_name(mapper, clause)
+    return _plugin_engines.get(plugin_name) if plugin_name else None
+
+
+def is_plugin_ready(plugin_name: str) -> bool:
+    """插件的数据库是否已经初始化完成
+
+    只有开启后台迁移时才会有未就绪的插件
+    """
+    event = _plugin_ready_events.get(plugin_name)
+    if event is None:
+        return True
+    return event.is_set() and plugin_name not in _plugin_init_errors
+
+
+def get_plugins_readiness() -> dict[str, bool]:
+    """获取后台迁移中各插件的数据库是否已经初始化完成"""
+    return {name: is_plugin_ready(name) for name in _plugin_ready_events}
+
+
+async def wait_plugin_ready(plugin_name: str) -> None:
+    """等待插件的数据库初始化完成
+
+    初始化失败时抛出 RuntimeError
+    """
+    if event := _plugin_ready_events.get(plugin_name):
+        await event.wait()
+    if error := _plugin_init_errors.get(plugin_name):
+        raise RuntimeError(f"插件 {plugin_name} 的数据库初始化失败") from error
+
+
+def _wait_plugin_ready(mapper, clause) -> None:
+    """在 Session 选择数据库引擎时等待语句所属插件的数据库初始化完成"""
+    if not _plugin_ready_events or _in_db_init.get() or not in_greenlet():
+        return
+    plugin_name = _get_plugin_name(mapper, clause)
+    if plugin_name and not is_plugin_ready(plugin_name):
+        await_only(wait_plugin_ready(plugin_name))
+
+
+def get_writer_engine() -> Optional["AsyncEngine"]:
+    """获取写入队列使用的数据库引擎
+
+    未开启写入队列时返回 None
+    """
+    if plugin_config.datastore_enable_database:
+        get_engine()
+    return _writer_engine
+
+
+def get_engines() -> dict[str, "AsyncEngine"]:
+    """获取所有已创建的数据库引擎
+
+    键为数据库引擎的名称
+    """
+    engines = {}
+    if _engine is not None:
+        engines["default"] = _engine
+    if _writer_engine is not None:
+        engines["writer"] = _writer_engine
+    if _read_engine is not None:
+        engines["read"] = _read_engine
+    for name, engine in _plugin_engines.items():
+        engines[f"plugin:{name}"] = engine
+    return engines
+
+
+def get_read_engine() -> "AsyncEngine":
+    """获取只读数据库引擎
+
+    未设置只读数据库时返回默认的数据库引擎
+    """
+    engine = get_engine()
+    return _read_engine or engine
+
+
+class RoutingSession(Session):
+    """根据语句类型选择数据库引擎的 Session
+
+    插件单独设置了数据库时，该插件的模型都会使用对应的数据库引擎
+    开启写入队列后，写入事务都会使用写入引擎
+    同一事务中写入之后的查询也会使用写入引擎，以便读取到未提交的数据
+    """
+
+    _datastore_writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        _wait_plugin_ready(mapper, clause)
+        # https://docs.sqlalchemy.org/en/20/orm/persistence_techniques.html#custom-vertical-partitioning
+        if plugin_engine := _get_plugin_engine(mapper, clause):
+            return plugin_engine.sync_engine
+        if _writer_engine is not None and (
+            self._datastore_writing
+            or self._flushing
+            or isinstance(clause, (Insert, Update, Delete))
+        ):
+            self._datastore_writing = True
+            return _writer_engine.sync_engine
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _reset_writing(session: RoutingSession, transaction) -> None:
+    if transaction.parent is None:
+        session._datastore_writing = False
+
+
+class ReadonlySession(Session):
+    """只读 Session
+
+    插件单独设置了数据库时，该插件的模型仍使用对应的数据库引擎
+    其他模型都使用只读数据库引擎
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        _wait_plugin_ready(mapper, clause)
+        if plugin_engine := _get_plugin_engine(mapper, clause):
+            return plugin_engine.sync_engine
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_begin")
+@event.listens_for(ReadonlySession, "after_begin")
+def _track_session(session: Session, transaction, connection) -> None:
+    _active_sessions.add(session)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+@event.listens_for(ReadonlySession, "after_transaction_end")
+def _untrack_session(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        _active_sessions.discard(session)
+
+
 def pre_db_init(func: Callable) -> Callable:
     """数据库初始化前执行的函数"""
     name = get_caller_plugin_name()
@@ -61,10 +310,23 @@ def pre_db_init(func: Callable) -> Callable:
     return func
 
 
-def post_db_init(func: Callable) -> Callable:
-    """数据库初始化后执行的函数"""
-    _post_db_init_funcs.append(func)
-    return func
+def post_db_init(
+    func: Optional[Callable] = None, *, depends_on: Iterable[Callable] = ()
+) -> Callable:
+    """数据库初始化后执行的函数
+
+    可通过 `depends_on` 指定需要在此之前执行完的函数
+    例: `@post_db_init(depends_on=[load_data])`
+    """
+
+    def _decorator(func: Callable) -> Callable:
+        _post_db_init_funcs.append(func)
+        _post_db_init_dependencies[func] = list(depends_on)
+        return func
+
+    if func is None:
+        return _decorator
+    return _decorator(func)
 
 
 async def run_funcs(funcs: list[Callable]) -> None:
@@ -84,50 +346,683 @@ async def run_pre_db_init_funcs(plugin: str) -> None:
         await run_funcs(funcs)
 
 
-async def run_post_db_init_funcs() -> None:
-    """运行数据库初始化后执行的函数"""
-    if _post_db_init_funcs:
-        logger.debug("运行数据库初始化后执行的函数")
-        await run_funcs(_post_db_init_funcs)
+def _get_func_name(func: Callable) -> str:
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+async def run_post_db_init_funcs() -> dict[str, float]:
+    """运行数据库初始化后执行的函数
+
+    按照依赖关系的拓扑顺序执行，没有依赖关系的函数按注册顺序执行
+    按照 `datastore_post_db_init_concurrency` 同时执行多个函数
+    函数出现异常时只会跳过依赖它的函数
+
+    返回每个函数执行所用的时间
+    """
+    if not _post_db_init_funcs:
+        return {}
+    logger.debug("运行数据库初始化后执行的函数")
+
+    sorter = TopologicalSorter()
+    for func in _post_db_init_funcs:
+        dependencies = []
+        for dependency in _post_db_init_dependencies.get(func, []):
+            if dependency in _post_db_init_dependencies:
+                dependencies.append(dependency)
+            else:
+                logger.warning(
+                    f"{_get_func_name(func)} 依赖的函数 {_get_func_name(dependency)} "
+                    "不是数据库初始化后执行的函数，已忽略"
+                )
+        sorter.add(func, *dependencies)
+    # 存在循环依赖时会抛出 CycleError
+    sorter.prepare()
+
+    concurrency = max(1, plugin_config.datastore_post_db_init_concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    durations: dict[str, float] = {}
+    failed: set[Callable] = set()
+
+    async def _run(func: Callable) -> Callable:
+        name = _get_func_name(func)
+        async with semaphore:
+            if any(dep in failed for dep in _post_db_init_dependencies[func]):
+                logger.warning(f"{name} 依赖的函数出现异常，跳过执行")
+                failed.add(func)
+                return func
+            start = time.perf_counter()
+            try:
+                await run_funcs([func])
+            except Exception:
+                logger.exception(f"数据库初始化后执行的函数 {name} 出现异常")
+                failed.add(func)
+            durations[name] = time.perf_counter() - start
+        return func
+
+    tasks: set[asyncio.Task] = set()
+    while sorter.is_active():
+        tasks.update(asyncio.create_task(_run(func)) for func in sorter.get_ready())
+        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            sorter.done(task.result())
+
+    summary = ", ".join(
+        f"{name}: {elapsed:.3f}s"
+        for name, elapsed in sorted(
+            durations.items(), key=lambda item: item[1], reverse=True
+        )
+    )
+    logger.debug(f"各数据库初始化后执行的函数耗时: {summary}")
+    return durations
+
+
+async def init_plugin_db(
+    plugin: str,
+    migration_lock: Optional[asyncio.Lock] = None,
+    profile: Optional[StartupProfile] = None,
+) -> float:
+    """初始化单个插件的数据库
+
+    返回初始化所用的时间，单位为秒，不包括等待其他插件升级的时间
+    """
+    from .script.command import upgrade
+    from .script.utils import Config
+
+    plugin_profile = profile.plugin(plugin) if profile else None
+
+    start = time.perf_counter()
+    # 执行数据库初始化前执行的函数
+    await run_pre_db_init_funcs(plugin)
+    pre_db_init_duration = time.perf_counter() - start
+    if plugin_profile:
+        plugin_profile.add("pre_db_init", pre_db_init_duration)
+    # 初始化数据库，升级到最新版本
+    logger.debug(f"初始化插件 {plugin} 的数据库")
+    config = Config(plugin)
+    # 迁移过程中各阶段的耗时通过 config.attributes 记录
+    config.attributes["profile"] = plugin_profile
+    start = time.perf_counter()
+    if migration_lock:
+        await migration_lock.acquire()
+    if plugin_profile:
+        # 等待其他插件升级的时间不计入该插件的总耗时
+        plugin_profile.add("lock_wait", time.perf_counter() - start)
+    try:
+        start = time.perf_counter()
+        await upgrade(config, "head")
+        upgrade_duration = time.perf_counter() - start
+    finally:
+        if migration_lock:
+            migration_lock.release()
+    duration = pre_db_init_duration + upgrade_duration
+    if plugin_profile:
+        plugin_profile.total = duration
+    if event := _plugin_ready_events.get(plugin):
+        event.set()
+    return duration
+
+
+async def init_plugins_db(
+    plugins: list[str], profile: Optional[StartupProfile] = None
+) -> dict[str, float]:
+    """初始化插件的数据库
+
+    按照 `datastore_migration_concurrency` 同时执行多个插件的 `pre_db_init` 函数
+    每个插件的 `pre_db_init` 函数都会在该插件升级前执行，升级本身始终逐个运行
+
+    返回每个插件初始化所用的时间
+    """
+    if plugin_config.datastore_migration_batch:
+        return await init_plugins_db_batch(plugins, profile)
+
+    concurrency = plugin_config.datastore_migration_concurrency
+    if concurrency <= 1:
+        return {
+            plugin: await init_plugin_db(plugin, profile=profile) for plugin in plugins
+        }
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # Alembic 的 context 与 op 都是全局的代理对象
+    # 同一时间只能有一个插件在运行迁移，否则迁移操作会串到其他插件的连接上
+    # SQLite 同一时间也只允许一个写入者
+    migration_lock = asyncio.Lock()
+
+    async def _init(plugin: str) -> float:
+        async with semaphore:
+            return await init_plugin_db(plugin, migration_lock, profile)
+
+    tasks = [asyncio.create_task(_init(plugin)) for plugin in plugins]
+    try:
+        durations = await asyncio.gather(*tasks)
+    except BaseException:
+        # 有插件初始化失败时，取消其他插件的初始化
+        for task in tasks:
+            task.cancel()
+        # 等待取消完成，避免未结束的任务在被回收时关闭其持有的连接
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return dict(zip(plugins, durations))
+
+
+MIGRATION_BATCH_MODES = ("transaction", "savepoint")
+"""批量迁移的方式
+
+- transaction: 所有插件在同一个事务中迁移，任意插件失败时全部回滚
+- savepoint: 每个插件使用一个保存点，插件失败时只回滚该插件，并提交之前的插件
+"""
+
+
+async def init_plugins_db_batch(
+    plugins: list[str], profile: Optional[StartupProfile] = None
+) -> dict[str, float]:
+    """在同一个连接中初始化插件的数据库
+
+    使用同一个数据库的插件共用一个连接与事务，按照 `datastore_migration_batch` 回滚
+    所有插件的 `pre_db_init` 函数都会在迁移开始前执行
+
+    返回每个插件初始化所用的时间
+    """
+    from .script.command import upgrade
+    from .script.utils import Config, migration_connection
+
+    mode = plugin_config.datastore_migration_batch
+    if mode not in MIGRATION_BATCH_MODES:
+        raise ValueError(f"未知的批量迁移方式: {mode}")
+
+    durations: dict[str, float] = {}
+    # 迁移时连接处于事务中，SQLite 的其他连接无法写入
+    # 所以需要在迁移开始前执行数据库初始化前执行的函数
+    for plugin in plugins:
+        start = time.perf_counter()
+        await run_pre_db_init_funcs(plugin)
+        durations[plugin] = time.perf_counter() - start
+        if profile:
+            profile.plugin(plugin).add("pre_db_init", durations[plugin])
+
+    # 单独设置了数据库的插件使用各自的连接
+    groups: dict[AsyncEngine, list[str]] = {}
+    for plugin in plugins:
+        groups.setdefault(get_engine(plugin), []).append(plugin)
+
+    for engine, group in groups.items():
+        migrated: list[str] = []
+        error = None
+        async with migration_connection(engine) as connection:
+            for plugin in group:
+                logger.debug(f"初始化插件 {plugin} 的数据库")
+                config = Config(plugin)
+                config.attributes["connection"] = connection
+                if profile:
+                    config.attributes["profile"] = profile.plugin(plugin)
+                start = time.perf_counter()
+                if mode == "transaction":
+                    await upgrade(config, "head")
+                else:
+                    try:
+                        async with connection.begin_nested():
+                            await upgrade(config, "head")
+                    except Exception as e:
+                        # 只回滚当前插件，之前的插件仍然提交
+                        error = e
+                        break
+                durations[plugin] += time.perf_counter() - start
+                migrated.append(plugin)
+
+        # 事务提交后插件才算初始化完成
+        for plugin in migrated:
+            if profile:
+                profile.plugin(plugin).total = durations[plugin]
+            if event := _plugin_ready_events.get(plugin):
+                event.set()
+        if error:
+            raise error
+    return durations
+
+
+async def get_outdated_plugins(plugins: list[str]) -> list[str]:
+    """获取需要升级数据库的插件
+
+    一次读取所有插件数据库的当前版本，并与缓存的迁移文件最新版本比较
+    有 `pre_db_init` 函数的插件始终需要完整的初始化流程
+    """
+    from .script.utils import get_current_revisions, get_head_revisions
+
+    if not plugins:
+        return []
+
+    current = await get_current_revisions(plugins)
+    heads = get_head_revisions(
+        [plugin for plugin in plugins if plugin not in _pre_db_init_funcs]
+    )
+    outdated = []
+    for plugin in plugins:
+        if plugin in heads and current[plugin] == heads[plugin]:
+            logger.debug(f"插件 {plugin} 的数据库已是最新版本，跳过迁移")
+            continue
+        outdated.append(plugin)
+    return outdated
 
 
 async def init_db():
     """初始化数据库"""
-    from .script.command import upgrade
-    from .script.utils import Config, get_plugins
+    from .script.utils import get_plugins
 
+    start = time.perf_counter()
     plugins = get_plugins()
+    if not plugins and not _post_db_init_funcs and _engine is None:
+        # 没有插件使用数据库时，不需要创建数据库引擎
+        logger.debug("没有插件使用数据库，跳过数据库初始化")
+        return
+
+    profile = StartupProfile()
+    phase_start = time.perf_counter()
+    get_engine()
+    profile.phases["engine"] = time.perf_counter() - phase_start
+    if plugin_config.datastore_migration_fast_path:
+        phase_start = time.perf_counter()
+        plugins = await get_outdated_plugins(plugins)
+        profile.phases["fast_path"] = time.perf_counter() - phase_start
+
+    if plugin_config.datastore_background_migration:
+        _start_background_migration(plugins, profile, start)
+        return
+    await _migrate_plugins(plugins, profile, start)
+
+
+def _start_background_migration(
+    plugins: list[str], profile: StartupProfile, start: float
+) -> None:
+    """在后台初始化插件的数据库
+
+    数据库已是最新版本的插件可以直接使用，其他插件的查询会等待该插件初始化完成
+    """
+    global _migration_task
+
     for plugin in plugins:
-        # 执行数据库初始化前执行的函数
-        await run_pre_db_init_funcs(plugin)
-        # 初始化数据库，升级到最新版本
-        logger.debug(f"初始化插件 {plugin} 的数据库")
-        config = Config(plugin)
-        await upgrade(config, "head")
+        _plugin_ready_events[plugin] = asyncio.Event()
+        _plugin_init_errors.pop(plugin, None)
+
+    def _set_unfinished_error(error: BaseException) -> None:
+        # 唤醒正在等待的查询，避免一直等待下去
+        for plugin in plugins:
+            event = _plugin_ready_events[plugin]
+            if not event.is_set():
+                _plugin_init_errors[plugin] = error
+                event.set()
+
+    async def _run() -> None:
+        _in_db_init.set(True)
+        try:
+            await _migrate_plugins(plugins, profile, start)
+        except Exception as e:
+            logger.exception("后台初始化数据库失败")
+            _set_unfinished_error(e)
+        except BaseException as e:
+            # 被取消时也需要设置尚未完成的插件的状态
+            _set_unfinished_error(e)
+            raise
+
+    if plugins:
+        logger.info(f"开始在后台初始化 {len(plugins)} 个插件的数据库")
+    _migration_task = asyncio.create_task(_run())
+
+
+async def stop_background_migration() -> None:
+    """关闭时取消尚未完成的后台迁移"""
+    if _migration_task and not _migration_task.done():
+        logger.warning("后台初始化数据库尚未完成，已取消")
+        _migration_task.cancel()
+        # 等待迁移释放连接后才能释放数据库引擎
+        await asyncio.gather(_migration_task, return_exceptions=True)
+
+
+def on_db_shutdown(func: Callable) -> Callable:
+    """关闭数据库前执行的函数
+
+    用于将缓存在内存中的数据写入数据库，会在等待会话完成与释放数据库引擎之前执行
+    """
+    _db_shutdown_funcs.append(func)
+    return func
+
+
+async def _wait_active_sessions(timeout: float) -> int:
+    """等待正在进行的事务完成，返回超时后仍未完成的事务数"""
+    deadline = time.perf_counter() + timeout
+    while _active_sessions and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    return len(_active_sessions)
+
+
+async def _checkpoint_sqlite(engine: "AsyncEngine") -> None:
+    """将 WAL 文件中的数据写回数据库，并清空 WAL 文件"""
+    async with engine.connect() as connection:
+        await connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+async def shutdown_db() -> None:
+    """关闭数据库
+
+    依次取消后台迁移、执行关闭数据库前执行的函数、等待正在进行的事务完成、
+    对 SQLite 数据库执行 WAL 检查点，最后释放所有数据库引擎
+    """
+    global _engine, _writer_engine, _read_engine, _plugin_engines
+
+    durations: dict[str, float] = {}
+
+    start = time.perf_counter()
+    await stop_background_migration()
+    try:
+        await run_funcs(_db_shutdown_funcs)
+    except Exception:
+        logger.exception("关闭数据库前执行的函数出现异常")
+    durations["关闭数据库前执行的函数"] = time.perf_counter() - start
+
+    engines = get_engines()
+    if engines:
+        start = time.perf_counter()
+        timeout = plugin_config.datastore_shutdown_timeout
+        if remaining := await _wait_active_sessions(timeout):
+            logger.warning(f"等待 {timeout}s 后仍有 {remaining} 个事务未完成")
+        durations["等待事务完成"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        checkpointed = set()
+        for name, engine in engines.items():
+            # 写入引擎与默认引擎使用同一个数据库文件
+            database = engine.url.database
+            if engine.dialect.name != "sqlite" or database in checkpointed:
+                continue
+            checkpointed.add(database)
+            try:
+                await _checkpoint_sqlite(engine)
+            except Exception:
+                logger.exception(f"数据库引擎 {name} 执行 WAL 检查点失败")
+        durations["WAL 检查点"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for engine in engines.values():
+            await engine.dispose()
+        _engine = _writer_engine = _read_engine = None
+        _plugin_engines = {}
+        durations["释放数据库引擎"] = time.perf_counter() - start
+
+    summary = ", ".join(f"{step} {elapsed:.3f}s" for step, elapsed in durations.items())
+    logger.info(f"数据库已关闭，{summary}")
+
+
+async def _warmup_engine(engine: "AsyncEngine", connections: int) -> int:
+    """预先打开数据库连接，返回打开的连接数
+
+    连接关闭后会放回连接池，之后的查询不用再新建连接
+    """
+    pool = engine.sync_engine.pool
+    if not isinstance(pool, QueuePool):
+        # 其他连接池不会保留连接，例如 NullPool
+        return 0
+    connections = min(connections, pool.size())
+    async with AsyncExitStack() as stack:
+        for _ in range(connections):
+            connection = await stack.enter_async_context(engine.connect())
+            await connection.execute(text("SELECT 1"))
+    return connections
+
+
+async def warmup() -> None:
+    """预热数据库
 
-    logger.info("数据库初始化完成")
+    配置所有模型的 mapper，并为每个数据库引擎预先打开连接
+    避免启动后第一次查询时才进行这些操作，导致响应变慢
+    """
+    start = time.perf_counter()
+    # 模型的 mapper 默认在第一次使用时才配置
+    configure_mappers()
+
+    connections = plugin_config.datastore_warmup_connections
+    opened = {
+        name: await _warmup_engine(engine, connections)
+        for name, engine in get_engines().items()
+    }
+    logger.debug(
+        f"数据库预热完成，耗时 {time.perf_counter() - start:.3f}s，"
+        f"打开的连接数: {opened}"
+    )
+
+
+async def _migrate_plugins(
+    plugins: list[str], profile: StartupProfile, start: float
+) -> None:
+    durations = await init_plugins_db(plugins, profile)
+
+    logger.info(f"数据库初始化完成，耗时 {time.perf_counter() - start:.3f}s")
+    if durations:
+        summary = ", ".join(
+            f"{plugin}: {elapsed:.3f}s"
+            for plugin, elapsed in sorted(
+                durations.items(), key=lambda item: item[1], reverse=True
+            )
+        )
+        logger.debug(f"各插件数据库初始化耗时: {summary}")
 
     # 执行数据库初始化后执行的函数
+    phase_start = time.perf_counter()
     try:
-        await run_post_db_init_funcs()
+        profile.post_db_init = await run_post_db_init_funcs()
     except Exception:
         logger.exception("数据库初始化后执行的函数出现异常")
+    profile.phases["post_db_init"] = time.perf_counter() - phase_start
+
+    if plugin_config.datastore_warmup:
+        phase_start = time.perf_counter()
+        try:
+            await warmup()
+        except Exception:
+            logger.exception("数据库预热失败")
+        profile.phases["warmup"] = time.perf_counter() - phase_start
+
+    profile.total = time.perf_counter() - start
+    if profile.plugins:
+        logger.debug(f"各插件数据库初始化各阶段耗时:\n{profile.format_table()}")
+    try:
+        save_profile(profile)
+    except OSError:
+        logger.exception("保存数据库初始化耗时失败")
 
 
 if plugin_config.datastore_enable_database:
-    _engine = _make_engine()
+    # 数据库引擎会在 init_db 或第一次调用 get_engine 时创建
     get_driver().on_startup(init_db)
+    get_driver().on_shutdown(shutdown_db)
+
+    if plugin_config.datastore_enable_metrics:
+        get_driver().on_startup(start_metrics_dump)
+        get_driver().on_shutdown(stop_metrics_dump)
 
 
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
+async def get_session(readonly: bool = False) -> AsyncGenerator[AsyncSession, None]:
     """需配合 `Depends` 使用
 
     例: `session: AsyncSession = Depends(get_session)`
+
+    只读: `session: AsyncSession = Depends(partial(get_session, readonly=True))`
     """
-    async with AsyncSession(get_engine()) as session:
+    async with create_session(readonly) as session:
         yield session
 
 
-def create_session() -> AsyncSession:
-    """创建一个新的 session"""
-    return AsyncSession(get_engine())
+SESSION_OPTIONS = ("expire_on_commit", "autoflush", "info")
+"""可以通过配置设置的 session 选项"""
+
+# session 工厂，键为插件名与是否只读
+_sessionmakers: dict[tuple[Optional[str], bool], async_sessionmaker] = {}
+
+
+def _get_session_plugin_name() -> Optional[str]:
+    """获取创建 session 的插件名
+
+    未设置插件单独使用的 session 选项时不需要获取
+    """
+    if not plugin_config.datastore_plugin_session_options:
+        return None
+    # 事件响应器的依赖中无法通过调用栈获取插件名
+    if matcher := current_matcher.get(None):
+        name = matcher.plugin_name
+    else:
+        try:
+            name = get_caller_plugin_name()
+        except ValueError:
+            return None
+    if name in plugin_config.datastore_plugin_session_options:
+        return name
+
+
+def get_session_options(plugin: Optional[str] = None) -> dict[str, Any]:
+    """获取创建 session 时使用的选项
+
+    插件单独设置的选项会覆盖全局设置的同名选项
+    """
+    options = {
+        **plugin_config.datastore_session_options,
+        **plugin_config.datastore_plugin_session_options.get(plugin or "", {}),
+    }
+    if unknown := set(options) - set(SESSION_OPTIONS):
+        raise ValueError(f"不支持的 session 选项: {', '.join(sorted(unknown))}")
+    return options
+
+
+def get_sessionmaker(
+    readonly: bool = False, plugin: Optional[str] = None
+) -> async_sessionmaker:
+    """获取 session 工厂
+
+    同样的插件与是否只读只会创建一次，创建 session 时再绑定数据库引擎
+    """
+    key = (plugin, readonly)
+    if key not in _sessionmakers:
+        _sessionmakers[key] = async_sessionmaker(
+            class_=AsyncSession,
+            sync_session_class=ReadonlySession if readonly else RoutingSession,
+            **get_session_options(plugin),
+        )
+    return _sessionmakers[key]
+
+
+def create_session(readonly: bool = False) -> AsyncSession:
+    """创建一个新的 session
+
+    `readonly` 为 True 时使用只读数据库，只能用于查询
+    session 的选项可以通过 `datastore_session_options` 与
+    `datastore_plugin_session_options` 设置
+    """
+    maker = get_sessionmaker(readonly, _get_session_plugin_name())
+    return maker(bind=get_read_engine() if readonly else get_engine())
+
+
+class EventSession(AsyncSession):
+    """事件共享的 session
+
+    同一优先级的事件响应器会同时运行，而 AsyncSession 不支持同时执行多个操作
+    所有需要等待的方法都会先获取 session 的锁，不同事件响应器的操作依次执行
+    其他事件响应器正在执行操作时，`add` 与 `add_all` 会等到该操作完成后再添加
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._lock = asyncio.Lock()
+        self._lock_owner: Optional[asyncio.Task] = None
+        self._deferred: list[Any] = []
+
+    def _is_held_by_other(self) -> bool:
+        return self._lock_owner is not None and (
+            self._lock_owner is not asyncio.current_task()
+        )
+
+    def add(self, instance: object, _warn: bool = True) -> None:
+        if self._is_held_by_other():
+            self._deferred.append(instance)
+            return
+        super().add(instance, _warn)
+
+    def add_all(self, instances: Iterable[object]) -> None:
+        if self._is_held_by_other():
+            self._deferred.extend(instances)
+            return
+        super().add_all(instances)
+
+    @asynccontextmanager
+    async def hold(self) -> AsyncIterator[None]:
+        """在当前任务中独占 session
+
+        连续的多个操作之间不能插入其他事件响应器的操作，
+        或者使用 `stream`、`begin` 等返回对象后仍需要使用连接的方法时使用
+        同一个任务中可以重复进入
+        """
+        task = asyncio.current_task()
+        if task is not None and task is self._lock_owner:
+            yield
+            return
+        async with self._lock:
+            self._lock_owner = task
+            try:
+                yield
+            finally:
+                self._lock_owner = None
+                if self._deferred:
+                    deferred, self._deferred = self._deferred, []
+                    super().add_all(deferred)
+
+
+def _hold_event_session(method: Callable) -> Callable:
+    @functools.wraps(method)
+    async def wrapper(self: EventSession, *args, **kwargs):
+        async with self.hold():
+            return await method(self, *args, **kwargs)
+
+    return wrapper
+
+
+for _name, _method in vars(AsyncSession).items():
+    if not _name.startswith("_") and inspect.iscoroutinefunction(_method):
+        setattr(EventSession, _name, _hold_event_session(_method))
+
+
+async def get_event_session(event: Event) -> AsyncSession:
+    """获取当前事件共享的 session，需配合 `Depends` 使用
+
+    例: `session: AsyncSession = Depends(get_event_session)`
+
+    处理同一个事件的所有事件响应器共用一个 session
+    同时运行的事件响应器的操作会依次执行，详见 `EventSession`
+    事件处理完成后自动提交，有事件响应器出现异常时回滚
+    """
+    key = id(event)
+    if key not in _event_sessions:
+        # session 在第一次查询时才会获取数据库连接
+        maker = get_sessionmaker(plugin=_get_session_plugin_name())
+        _event_sessions[key] = EventSession(**{**maker.kw, "bind": get_engine()})
+    return _event_sessions[key]
+
+
+@run_postprocessor
+async def _mark_event_session_failed(
+    event: Event, exception: Optional[Exception]
+) -> None:
+    if exception is not None and id(event) in _event_sessions:
+        _failed_events.add(id(event))
+
+
+@event_postprocessor
+async def _close_event_session(event: Event) -> None:
+    key = id(event)
+    if not (session := _event_sessions.pop(key, None)):
+        return
+    try:
+        if key in _failed_events:
+            await session.rollback()
+        else:
+            await session.commit()
+    except Exception:
+        logger.exception("提交事件共享的 session 失败")
+        await session.rollback()
+    finally:
+        _failed_events.discard(key)
+        await session.close()
@@ -0,0 +1,164 @@
+"""合并提交
+
+每次提交事务时 SQLite 都需要将数据同步到磁盘，频繁提交的小事务会受限于磁盘同步的速度
+合并提交将一段时间内提交的写入操作放在同一个事务中执行，只需同步一次
+"""
+
+import asyncio
+from collections.abc import Awaitable
+from typing import Any, Callable, Optional, TypeVar
+
+from nonebot.log import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import plugin_config
+from .db import create_session, on_db_shutdown
+
+T = TypeVar("T")
+
+Operation = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class GroupCommitter:
+    """合并提交写入操作
+
+    提交的操作会在 `interval` 秒后，或者等待的操作达到 `max_operations` 个时
+    在同一个事务中按提交顺序执行
+    """
+
+    def __init__(
+        self, interval: Optional[float] = None, max_operations: Optional[int] = None
+    ) -> None:
+        self.interval = (
+            plugin_config.datastore_group_commit_interval
+            if interval is None
+            else interval
+        )
+        self.max_operations = (
+            max_operations or plugin_config.datastore_group_commit_max_operations
+        )
+        self.batches = 0
+        """提交的事务数"""
+        self.operations = 0
+        """执行的操作数"""
+        self.fallbacks = 0
+        """合并提交失败后逐个执行的次数"""
+
+        self._pending: list[tuple[Operation, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        """获取当前事件循环中的锁
+
+        在 Python 3.9 中创建锁时就会绑定事件循环，所以不在 `__init__` 中创建
+        """
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    async def submit(self, func: Callable[[AsyncSession], Awaitable[T]]) -> T:
+        """提交写入操作
+
+        等待操作所在的事务提交后返回 `func` 的返回值
+        `func` 中不需要提交事务
+        合并提交失败时会逐个重新执行，所以 `func` 中不应有数据库以外的副作用
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((func, future))
+        if len(self._pending) >= self.max_operations:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.interval, self._start_flush)
+        return await future
+
+    def _start_flush(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        """立即提交所有等待的操作"""
+        async with self._get_lock():
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+
+            try:
+                async with create_session() as session, session.begin():
+                    results = [await func(session) for func, _ in batch]
+            except Exception:
+                # 有操作失败时整个事务都会回滚，逐个重新执行，避免影响其他操作
+                logger.debug(f"合并提交 {len(batch)} 个操作失败，改为逐个执行")
+                self.fallbacks += 1
+                await self._run_each(batch)
+            else:
+                self.batches += 1
+                self.operations += len(batch)
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    async def _run_each(self, batch: list[tuple[Operation, asyncio.Future]]) -> None:
+        for func, future in batch:
+            try:
+                async with create_session() as session, session.begin():
+                    result = await func(session)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.batches += 1
+                self.operations += 1
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self) -> None:
+        """提交所有等待的操作"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+_committer: Optional[GroupCommitter] = None
+
+
+def get_group_committer() -> GroupCommitter:
+    """获取默认的合并提交器"""
+    global _committer
+
+    if _committer is None:
+        _committer = GroupCommitter()
+    return _committer
+
+
+async def group_commit(func: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    """通过默认的合并提交器提交写入操作
+
+    例:
+    ```python
+    async def add_example(session: AsyncSession) -> None:
+        session.add(Example(message="group"))
+
+    await group_commit(add_example)
+    ```
+    """
+    return await get_group_committer().submit(func)
+
+
+@on_db_shutdown
+async def close_group_committer() -> None:
+    """关闭数据库前提交所有等待的操作"""
+    if _committer is not None:
+        await _committer.close()
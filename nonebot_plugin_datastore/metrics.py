@@ -0,0 +1,226 @@
+"""数据库指标
+
+通过 SQLAlchemy 的引擎与连接池事件统计连接池与查询的相关数据
+"""
+
+import asyncio
+import json
+import time
+from functools import wraps
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+from nonebot.log import logger
+from sqlalchemy import event
+
+from .config import plugin_config
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio.engine import AsyncEngine
+
+METRICS_FILENAME = "metrics.json"
+
+# 直方图的分桶上限，单位为秒
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+class Histogram:
+    """耗时直方图"""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def as_dict(self) -> dict[str, Any]:
+        buckets = {f"le_{bound}": 0 for bound in self.buckets}
+        buckets["le_inf"] = 0
+        # 与 Prometheus 一样使用累计值
+        total = 0
+        for key, count in zip(buckets, self.counts):
+            total += count
+            buckets[key] = total
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class EngineMetrics:
+    """单个数据库引擎的指标"""
+
+    def __init__(self) -> None:
+        self.connects = 0
+        """新建的数据库连接数"""
+        self.checkouts = 0
+        """从连接池取出连接的次数"""
+        self.checkins = 0
+        """连接归还连接池的次数"""
+        self.invalidations = 0
+        """失效的连接数"""
+        self.checkout_wait = Histogram()
+        """获取连接的等待时间"""
+        self.queries = 0
+        """执行的语句数"""
+        self.errors = 0
+        """执行出错的语句数"""
+        self.query_latency = Histogram()
+        """语句的执行时间"""
+
+    @property
+    def active_connections(self) -> int:
+        """正在使用的连接数"""
+        return self.checkouts - self.checkins
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "active_connections": self.active_connections,
+            "invalidations": self.invalidations,
+            "checkout_wait": self.checkout_wait.as_dict(),
+            "queries": self.queries,
+            "errors": self.errors,
+            "query_latency": self.query_latency.as_dict(),
+        }
+
+
+_metrics: dict[str, EngineMetrics] = {}
+_dump_task: Optional[asyncio.Task] = None
+
+
+def setup_engine_metrics(engine: "AsyncEngine", name: str) -> EngineMetrics:
+    """监听数据库引擎的事件，统计指标"""
+    metrics = _metrics[name] = EngineMetrics()
+    sync_engine = engine.sync_engine
+
+    # 连接池没有获取连接前的事件，所以直接统计获取原始连接的耗时
+    # 包括等待连接池空闲连接与新建连接的时间
+    raw_connection = sync_engine.raw_connection
+
+    @wraps(raw_connection)
+    def timed_raw_connection():
+        start = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            metrics.checkout_wait.observe(time.perf_counter() - start)
+
+    sync_engine.raw_connection = timed_raw_connection
+
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.connects += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.checkouts += 1
+
+    @event.listens_for(sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        metrics.checkins += 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.invalidations += 1
+
+    # https://docs.sqlalchemy.org/en/20/faq/performance.html#query-profiling
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("datastore_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["datastore_query_start"].pop()
+        metrics.queries += 1
+        metrics.query_latency.observe(time.perf_counter() - start)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        metrics.errors += 1
+        if connection := exception_context.connection:
+            starts = connection.info.get("datastore_query_start")
+            if starts:
+                starts.pop()
+
+    return metrics
+
+
+def get_metrics() -> dict[str, dict[str, Any]]:
+    """获取所有数据库引擎的指标
+
+    键为数据库引擎的名称，时间单位为秒
+    """
+    return {name: metrics.as_dict() for name, metrics in _metrics.items()}
+
+
+def get_metrics_file() -> Path:
+    """指标数据文件的位置"""
+    from .plugin import PluginData
+
+    return PluginData("nonebot_plugin_datastore").cache_dir / METRICS_FILENAME
+
+
+def dump_metrics() -> None:
+    """将指标保存至缓存目录，供命令行读取"""
+    data = {"updated_at": time.time(), "engines": get_metrics()}
+    get_metrics_file().write_text(json.dumps(data, indent=2), encoding="utf8")
+
+
+async def _dump_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            dump_metrics()
+        except Exception:
+            logger.exception("保存数据库指标失败")
+
+
+async def start_metrics_dump() -> None:
+    """定时保存指标"""
+    global _dump_task
+
+    interval = plugin_config.datastore_metrics_dump_interval
+    if interval > 0:
+        _dump_task = asyncio.create_task(_dump_periodically(interval))
+
+
+async def stop_metrics_dump() -> None:
+    """停止定时保存指标，并保存最后一次"""
+    global _dump_task
+
+    if _dump_task:
+        _dump_task.cancel()
+        _dump_task = None
+    dump_metrics()
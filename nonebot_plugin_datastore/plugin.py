@@ -3,7 +3,7 @@
 import json
 import pickle
 from pathlib import Path
-from typing import Any, Callable, Generic, Optional, TypeVar
+from typing import TYPE_CHECKING, Any, Callable, Generic, Optional, TypeVar
 
 import httpx
 from nonebot import get_plugin
@@ -15,6 +15,9 @@ from .config import plugin_config
 from .providers import ConfigProvider
 from .utils import get_caller_plugin_name, resolve_dot_notation
 
+if TYPE_CHECKING:
+    from .counter import Counter
+
 T = TypeVar("T")
 R = TypeVar("R")
 
@@ -127,6 +130,7 @@ class PluginData(metaclass=Singleton):
         self._model = None
         self._migration_path = None
         self._use_global_registry = False
+        self._counters: dict[tuple[type, str], Counter] = {}
 
     @staticmethod
     def _ensure_dir(path: Path):
@@ -298,6 +302,19 @@ class PluginData(metaclass=Singleton):
         """设置数据库迁移文件夹"""
         self._migration_path = path
 
+    def counter(self, model: type[DeclarativeBase], value: str = "count") -> "Counter":
+        """获取计数器
+
+        `model` 为插件的数据库模型，主键为计数的键，`value` 为存放计数的列
+        计数先累加在内存中，定时批量写入数据库，关闭时也会写入
+        """
+        from .counter import Counter
+
+        key = (model, value)
+        if key not in self._counters:
+            self._counters[key] = Counter(model, value)
+        return self._counters[key]
+
     def use_global_registry(self):
         """使用全局的 registry
 
@@ -0,0 +1,132 @@
+"""启动耗时分析
+
+记录数据库初始化时每个插件各个阶段所用的时间
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+PROFILE_FILENAME = "startup_profile.json"
+
+PLUGIN_PHASES = (
+    "pre_db_init",
+    "lock_wait",
+    "script_directory",
+    "connect",
+    "version_lookup",
+    "revisions",
+)
+"""插件初始化的各个阶段
+
+- pre_db_init: 运行数据库初始化前执行的函数
+- lock_wait: 等待其他插件升级完成，不计入插件的总耗时
+- script_directory: 加载迁移文件
+- connect: 获取数据库连接
+- version_lookup: 读取数据库当前版本
+- revisions: 执行所有迁移
+"""
+
+
+class PluginProfile:
+    """单个插件的初始化耗时"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.phases: dict[str, float] = {}
+        self.revisions: list[dict[str, Any]] = []
+        """每个迁移所用的时间"""
+        self.total = 0.0
+
+    def add(self, phase: str, duration: float) -> None:
+        """累加阶段的耗时"""
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def add_revision(self, revision: str, duration: float) -> None:
+        self.revisions.append({"revision": revision, "duration": duration})
+        self.add("revisions", duration)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "total": self.total,
+            "phases": self.phases,
+            "revisions": self.revisions,
+        }
+
+
+class StartupProfile:
+    """数据库初始化耗时"""
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.phases: dict[str, float] = {}
+        """与插件无关的阶段，例如创建数据库引擎"""
+        self.plugins: dict[str, PluginProfile] = {}
+        self.post_db_init: dict[str, float] = {}
+        """每个数据库初始化后执行的函数所用的时间"""
+        self.total = 0.0
+
+    def plugin(self, name: str) -> PluginProfile:
+        """获取插件的初始化耗时"""
+        if name not in self.plugins:
+            self.plugins[name] = PluginProfile(name)
+        return self.plugins[name]
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "total": self.total,
+            "phases": self.phases,
+            "plugins": {
+                name: plugin.as_dict() for name, plugin in self.plugins.items()
+            },
+            "post_db_init": self.post_db_init,
+        }
+
+    def format_table(self) -> str:
+        """以表格形式展示每个插件各阶段的耗时"""
+        headers = ["插件", "总计", *PLUGIN_PHASES]
+        rows = [
+            [
+                name,
+                f"{plugin.total:.3f}s",
+                *(f"{plugin.phases.get(phase, 0.0):.3f}s" for phase in PLUGIN_PHASES),
+            ]
+            for name, plugin in sorted(
+                self.plugins.items(), key=lambda item: item[1].total, reverse=True
+            )
+        ]
+        widths = [
+            max(len(row[index]) for row in [headers, *rows])
+            for index in range(len(headers))
+        ]
+        return "\n".join(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+            for row in [headers, *rows]
+        )
+
+
+_last_profile: Optional[StartupProfile] = None
+
+
+def get_profile_file() -> Path:
+    """启动耗时数据文件的位置"""
+    from .plugin import PluginData
+
+    return PluginData("nonebot_plugin_datastore").cache_dir / PROFILE_FILENAME
+
+
+def save_profile(profile: StartupProfile) -> None:
+    """保存启动耗时至缓存目录，供命令行读取"""
+    global _last_profile
+
+    _last_profile = profile
+    get_profile_file().write_text(
+        json.dumps(profile.as_dict(), indent=2, ensure_ascii=False), encoding="utf8"
+    )
+
+
+def get_last_profile() -> Optional[StartupProfile]:
+    """获取最近一次数据库初始化的耗时"""
+    return _last_profile
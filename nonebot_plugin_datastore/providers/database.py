@@ -4,6 +4,7 @@ from sqlalchemy import JSON, select
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import Mapped, mapped_column
 
+from ..bulk import bulk_upsert
 from ..db import create_session
 from ..plugin import get_plugin_data
 from . import ConfigProvider, KeyNotFoundError
@@ -35,5 +36,5 @@ class Config(ConfigProvider):
     async def _set(self, key: str, value: Any) -> None:
         db_key = self._plugin_data.name + "_" + key
         async with create_session() as session:
-            await session.merge(ConfigModel(key=db_key, value=value))
+            await bulk_upsert(session, ConfigModel, [{"key": db_key, "value": value}])
             await session.commit()
@@ -0,0 +1,115 @@
+"""事务重试
+
+SQLite 同一时间只允许一个写入者，多个会话同时写入时可能报错 `database is locked`
+重试时会重新执行整个事务，并使用带随机抖动的指数退避等待
+"""
+
+import asyncio
+import random
+from collections.abc import Awaitable
+from typing import Any, Callable, Optional, TypeVar
+
+from nonebot.log import logger
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import plugin_config
+from .db import create_session
+
+T = TypeVar("T")
+
+BUSY_ERROR_MESSAGES = (
+    "database is locked",
+    "database is busy",
+    "database table is locked",
+)
+
+
+class RetryStats:
+    """事务重试统计"""
+
+    def __init__(self) -> None:
+        self.transactions = 0
+        """执行的事务数"""
+        self.retries = 0
+        """重试的次数"""
+        self.give_ups = 0
+        """重试次数用尽后放弃的事务数"""
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "transactions": self.transactions,
+            "retries": self.retries,
+            "give_ups": self.give_ups,
+        }
+
+
+retry_stats = RetryStats()
+
+
+def is_busy_error(error: BaseException) -> bool:
+    """是否为数据库繁忙或被锁定的错误"""
+    if not isinstance(error, OperationalError):
+        return False
+    message = str(error.orig).lower()
+    return any(busy_message in message for busy_message in BUSY_ERROR_MESSAGES)
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """第 `attempt` 次重试前等待的时间
+
+    使用 full jitter，即在 0 与指数退避的时间之间随机选择
+    https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+    """
+    delay = min(
+        plugin_config.datastore_retry_max_delay,
+        plugin_config.datastore_retry_base_delay * 2 ** (attempt - 1),
+    )
+    return random.uniform(0, delay)
+
+
+async def run_transaction(
+    func: Callable[[AsyncSession], Awaitable[T]],
+    readonly: bool = False,
+    attempts: Optional[int] = None,
+) -> T:
+    """在事务中执行函数，数据库繁忙或被锁定时重试
+
+    每次尝试都会创建新的 session 并开启事务，`func` 正常返回后提交
+    重试时会重新执行 `func`，所以其中不应有数据库以外的副作用
+    `attempts` 为最多尝试的次数，默认为 `datastore_retry_attempts`
+
+    例:
+    ```python
+    async def add_example(session: AsyncSession) -> None:
+        session.add(Example(message="retry"))
+
+    await run_transaction(add_example)
+    ```
+    """
+    attempts = attempts or plugin_config.datastore_retry_attempts
+    retry_stats.transactions += 1
+
+    attempt = 1
+    while True:
+        try:
+            async with create_session(readonly) as session, session.begin():
+                return await func(session)
+        except OperationalError as e:
+            if not is_busy_error(e):
+                raise
+            if attempt >= attempts:
+                retry_stats.give_ups += 1
+                logger.warning(f"数据库繁忙，已重试 {attempt - 1} 次，放弃执行事务")
+                raise
+
+        delay = get_backoff_delay(attempt)
+        retry_stats.retries += 1
+        logger.debug(f"数据库繁忙，{delay:.3f}s 后进行第 {attempt} 次重试")
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def get_retry_stats() -> dict[str, Any]:
+    """获取事务重试的统计信息"""
+    return retry_stats.as_dict()
@@ -0,0 +1,220 @@
+"""分批回填数据
+
+在迁移中更新大量数据时，一条语句或一个事务会长时间占用写锁，失败后也需要从头开始
+回填按主键范围分批处理，每批处理完成后提交并记录进度，中断后重新运行迁移时从上次的位置继续
+"""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Callable, Optional, Union
+from uuid import UUID
+
+from alembic import op
+from nonebot.log import logger
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    Update,
+    column,
+    delete,
+    insert,
+    inspect,
+    select,
+    table,
+    update,
+)
+
+from ..config import plugin_config
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Connection
+
+BACKFILL_TABLE_NAME = "nonebot_plugin_datastore_backfill"
+
+# 不属于任何插件的 metadata，生成迁移文件时不会包含此表
+backfill_table = Table(
+    BACKFILL_TABLE_NAME,
+    MetaData(),
+    Column("name", String(255), primary_key=True),
+    Column("last_key", Text, nullable=False),
+    Column("rows", Integer, nullable=False),
+)
+"""记录回填进度的表"""
+
+Process = Union[Update, Callable[["Connection", Any, Any], Any]]
+
+# 进度中保存的 JSON 不支持的主键类型，datetime 是 date 的子类，需要放在前面
+KEY_TYPES: dict[str, tuple[type, Callable[[Any], str], Callable[[str], Any]]] = {
+    "datetime": (datetime, datetime.isoformat, datetime.fromisoformat),
+    "date": (date, date.isoformat, date.fromisoformat),
+    "time": (time, time.isoformat, time.fromisoformat),
+    "uuid": (UUID, str, UUID),
+    "decimal": (Decimal, str, Decimal),
+}
+
+
+def _get_default_name(table_name: str) -> str:
+    """根据调用回填的迁移生成进度名称
+
+    迁移完成后才会更新数据库中的版本，所以迁移时数据库中的版本即为上一个版本
+    中断后重新运行同一个迁移时生成的名称不变
+    """
+    context = op.get_context()
+    heads = "+".join(sorted(context.get_current_heads())) or "base"
+    return f"{context.version_table}:{heads}:{table_name}"
+
+
+def _get_key(connection: "Connection", table_name: str) -> str:
+    columns = inspect(connection).get_pk_constraint(table_name)["constrained_columns"]
+    if len(columns) != 1:
+        raise ValueError(f"表 {table_name} 的主键不是单独一列，请指定 key")
+    return columns[0]
+
+
+def _encode_key(value: Any) -> str:
+    """将主键转换为保存在进度中的 JSON"""
+    for name, (type_, encode, _) in KEY_TYPES.items():
+        if isinstance(value, type_):
+            return json.dumps({"type": name, "value": encode(value)})
+    try:
+        return json.dumps(value)
+    except TypeError:
+        raise TypeError(
+            f"无法记录类型为 {type(value).__name__} 的主键，请指定其他 key"
+        ) from None
+
+
+def _decode_key(data: str) -> Any:
+    value = json.loads(data)
+    if isinstance(value, dict):
+        _, _, decode = KEY_TYPES[value["type"]]
+        return decode(value["value"])
+    return value
+
+
+def _get_checkpoint(connection: "Connection", name: str) -> Optional[tuple[Any, int]]:
+    backfill_table.create(connection, checkfirst=True)
+    row = connection.execute(
+        select(backfill_table.c.last_key, backfill_table.c.rows).where(
+            backfill_table.c.name == name
+        )
+    ).one_or_none()
+    if row is None:
+        return None
+    return _decode_key(row.last_key), row.rows
+
+
+def _save_checkpoint(
+    connection: "Connection", name: str, last_key: str, rows: int, exists: bool
+) -> None:
+    values = {"last_key": last_key, "rows": rows}
+    if exists:
+        connection.execute(
+            update(backfill_table).where(backfill_table.c.name == name).values(values)
+        )
+    else:
+        connection.execute(insert(backfill_table).values(name=name, **values))
+
+
+def _run_backfill(
+    connection: "Connection",
+    table_name: str,
+    process: Process,
+    chunk_size: int,
+    key: Optional[str],
+    name: str,
+) -> int:
+    key = key or _get_key(connection, table_name)
+    # 使用表中的类型，以便读取到的主键与比较时的参数都是对应的 Python 类型
+    types = {c["name"]: c["type"] for c in inspect(connection).get_columns(table_name)}
+    key_column = table(table_name, column(key, types.get(key))).c[key]
+
+    checkpoint = _get_checkpoint(connection, name)
+    last_key, rows = checkpoint if checkpoint else (None, 0)
+    if checkpoint:
+        logger.info(f"从上次中断的位置继续回填 {name}，已处理 {rows} 行")
+
+    while True:
+        statement = select(key_column).order_by(key_column).limit(chunk_size)
+        if last_key is not None:
+            statement = statement.where(key_column > last_key)
+        chunk = connection.execute(statement).scalars().all()
+        if not chunk:
+            break
+
+        lower, upper = chunk[0], chunk[-1]
+        # 处理之前确认可以记录进度，避免提交之后才发现无法记录
+        encoded = _encode_key(upper)
+        if isinstance(process, Update):
+            # 不绑定表的列，避免与语句中的表不是同一个对象
+            connection.execute(
+                process.where(column(key, key_column.type).between(lower, upper))
+            )
+        else:
+            process(connection, lower, upper)
+
+        rows += len(chunk)
+        _save_checkpoint(connection, name, encoded, rows, checkpoint is not None)
+        checkpoint = (upper, rows)
+        last_key = upper
+        logger.debug(f"回填 {name} 已处理 {rows} 行")
+
+    connection.execute(delete(backfill_table).where(backfill_table.c.name == name))
+    return rows
+
+
+def backfill(
+    table_name: str,
+    process: Process,
+    chunk_size: Optional[int] = None,
+    key: Optional[str] = None,
+    name: Optional[str] = None,
+) -> int:
+    """在迁移中按主键范围分批回填数据
+
+    `process` 为 UPDATE 语句时，会自动加上主键范围的条件
+    为函数时会以连接与该批主键的最小值、最大值调用，需要自行限定范围
+    每批 `chunk_size` 行，默认为 `datastore_backfill_chunk_size`
+    `key` 为用于分批的主键列，默认为表的主键
+    主键的值需为 JSON 支持的类型或 `KEY_TYPES` 中的类型
+    `name` 为进度的名称，默认根据插件、迁移前的版本与表名生成
+    同一个迁移中多次回填同一张表时需要分别指定
+
+    每批处理完成后立即提交，进度记录在 `nonebot_plugin_datastore_backfill` 表中
+    中断后重新运行迁移时会从上次的位置继续，全部完成后删除进度
+    一批处理完成但尚未记录进度时中断，这一批会被重新处理，所以处理应可重复执行
+    返回处理的行数
+
+    例:
+    ```python
+    def upgrade() -> None:
+        example = sa.table("plugin_example", sa.column("message"))
+        backfill(
+            "plugin_example",
+            sa.update(example).values(message=sa.func.upper(example.c.message)),
+        )
+    ```
+    """
+    context = op.get_context()
+    if context.as_sql:
+        raise ValueError("生成 SQL 时无法回填数据")
+
+    chunk_size = chunk_size or plugin_config.datastore_backfill_chunk_size
+    if chunk_size <= 0:
+        raise ValueError("chunk_size 必须大于 0")
+    name = name or _get_default_name(table_name)
+
+    config = context.config
+    if config and config.attributes.get("connection"):
+        # 批量迁移时由外层传入连接，所有迁移在同一个事务中，无法分批提交
+        logger.warning(f"迁移处于外部事务中，回填 {name} 将在该事务中完成")
+        return _run_backfill(op.get_bind(), table_name, process, chunk_size, key, name)
+
+    # 提交之前的迁移操作，之后每条语句单独提交
+    with context.autocommit_block():
+        return _run_backfill(op.get_bind(), table_name, process, chunk_size, key, name)
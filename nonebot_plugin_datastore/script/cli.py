@@ -7,6 +7,7 @@ except ImportError as e:  # pragma: no cover
         "请使用 `pip install nonebot-plugin-datastore[cli]` 安装所需依赖"
     ) from e
 
+import json
 from argparse import Namespace
 from collections.abc import Coroutine
 from functools import partial, wraps
@@ -15,9 +16,14 @@ from typing import Any, Callable, Optional, TypeVar
 from nonebot.log import logger
 
 from ..config import plugin_config
-from ..db import run_pre_db_init_funcs
+from ..db import get_engine, run_pre_db_init_funcs
+from ..metrics import get_metrics_file
 from ..plugin import PluginData
+from ..profile import get_profile_file
+from ..sqlite import get_applied_pragmas
 from . import command
+from .estimate import estimate_upgrade
+from .squash import generate_baseline
 from .utils import Config, get_plugins
 
 P = ParamSpec("P")
@@ -92,10 +98,17 @@ async def migrate(name: Optional[str], message: Optional[str]):
 
 @cli.command()
 @click.option("--name", "-n", default=None, help="插件名")
+@click.option("--dry-run", is_flag=True, help="只估算待执行迁移的开销，不修改数据库")
 @click.argument("revision", default="head")
 @run_async
-async def upgrade(name: Optional[str], revision: str):
+async def upgrade(name: Optional[str], revision: str, dry_run: bool):
     """升级数据库版本"""
+    if dry_run:
+        for plugin in get_plugins_or_bad_parameter(name):
+            estimate = await estimate_upgrade(Config(plugin), revision)
+            click.echo(estimate.format())
+        return
+
     # 执行数据库初始化前执行的函数
     # 比如 bison 需要在迁移之前把 alembic_version 表重命名
     plugins = get_plugins_or_bad_parameter(name)
@@ -181,6 +194,24 @@ async def check(name: Optional[str]):
         await command.check(config)
 
 
+@cli.command()
+@click.option("--name", "-n", default=None, help="插件名")
+@click.option("--force", is_flag=True, help="迁移文件中有基线无法重现的操作时仍然生成")
+@run_async
+async def squash(name: Optional[str], force: bool):
+    """合并迁移文件，生成新安装时使用的基线迁移
+
+    需要先将数据库升级到最新版本，并保证模型与迁移文件一致
+    """
+    plugins = get_plugins_or_bad_parameter(name, True)
+    for plugin in plugins:
+        logger.info(f"检查插件 {plugin} 的模型与迁移文件是否一致")
+        config = Config(plugin)
+        await command.check(config)
+        baseline_file = generate_baseline(config, force)
+        logger.info(f"已生成插件 {plugin} 的基线迁移: {baseline_file}")
+
+
 @cli.command()
 @click.option("--name", "-n", default=None, help="插件名")
 def dir(name: Optional[str] = None):
@@ -201,5 +232,47 @@ def dir(name: Optional[str] = None):
         click.echo(f"数据目录: {plugin_data.data_dir}")
 
 
+@cli.command()
+@run_async
+async def pragma():
+    """SQLite 当前生效的 PRAGMA"""
+    engine = get_engine()
+    if engine.dialect.name != "sqlite":
+        raise click.UsageError("当前数据库不是 SQLite")
+
+    for name, value in (await get_applied_pragmas(engine)).items():
+        click.echo(f"{name}: {value}")
+
+
+@cli.command()
+def metrics():
+    """数据库连接池与查询指标
+
+    读取机器人运行时保存的指标数据
+    """
+    metrics_file = get_metrics_file()
+    if not metrics_file.exists():
+        raise click.ClickException(
+            "未找到指标数据，请开启 datastore_enable_metrics 后运行机器人"
+        )
+
+    data = json.loads(metrics_file.read_text(encoding="utf8"))
+    click.echo(json.dumps(data, indent=2, ensure_ascii=False))
+
+
+@cli.command()
+def profile():
+    """数据库初始化各阶段的耗时
+
+    读取机器人最近一次启动时保存的数据
+    """
+    profile_file = get_profile_file()
+    if not profile_file.exists():
+        raise click.ClickException("未找到数据库初始化耗时数据，请先运行机器人")
+
+    data = json.loads(profile_file.read_text(encoding="utf8"))
+    click.echo(json.dumps(data, indent=2, ensure_ascii=False))
+
+
 def main():
     anyio.run(run_sync(cli))  # pragma: no cover
@@ -5,16 +5,17 @@ version: 1.9.2
 
 from __future__ import annotations
 
+import time
 from typing import TYPE_CHECKING
 
 from alembic.autogenerate.api import RevisionContext
 from alembic.runtime.environment import EnvironmentContext
-from alembic.script import ScriptDirectory
 from alembic.util.exc import AutogenerateDiffsDetected, CommandError
 from alembic.util.messaging import obfuscate_url_pw
 from sqlalchemy.util.langhelpers import asbool
 
-from .utils import run_migration
+from .squash import load_baseline
+from .utils import get_script_directory, run_migration
 
 if TYPE_CHECKING:
     from alembic.config import Config
@@ -80,7 +81,7 @@ async def revision(
 
     """
 
-    script_directory = ScriptDirectory.from_config(config)
+    script_directory = get_script_directory(config)
 
     command_args = {
         "message": message,
@@ -160,7 +161,7 @@ async def check(
 
     """
 
-    script_directory = ScriptDirectory.from_config(config)
+    script_directory = get_script_directory(config)
 
     command_args = {
         "message": None,
@@ -223,7 +224,10 @@ async def upgrade(
 
     """
 
-    script = ScriptDirectory.from_config(config)
+    start = time.perf_counter()
+    script = get_script_directory(config)
+    if profile := config.attributes.get("profile"):
+        profile.add("script_directory", time.perf_counter() - start)
 
     starting_rev = None
     if ":" in revision:
@@ -231,7 +235,19 @@ async def upgrade(
             raise CommandError("Range revision not allowed")
         starting_rev, revision = revision.split(":", 2)
 
+    # 新安装时如果有基线迁移，直接创建最终的表结构
+    baseline = None
+    if not sql and revision in ("head", "heads"):
+        baseline = load_baseline(config)
+
     def upgrade(rev, context):
+        if baseline and not rev:
+            baseline.upgrade()
+            # 先将版本标记为基线对应的版本，再执行之后新增的迁移
+            return [
+                *script._stamp_revs(baseline.revision, rev),
+                *script._upgrade_revs(revision, baseline.revision),
+            ]
         return script._upgrade_revs(revision, rev)
 
     with EnvironmentContext(
@@ -266,7 +282,7 @@ async def downgrade(
 
     """
 
-    script = ScriptDirectory.from_config(config)
+    script = get_script_directory(config)
     starting_rev = None
     if ":" in revision:
         if not sql:
@@ -309,7 +325,7 @@ async def history(
     """
     base: str | None
     head: str | None
-    script = ScriptDirectory.from_config(config)
+    script = get_script_directory(config)
     if rev_range is not None:
         if ":" not in rev_range:
             raise CommandError(
@@ -367,7 +383,7 @@ def heads(config, verbose=False, resolve_dependencies=False):
 
     """
 
-    script = ScriptDirectory.from_config(config)
+    script = get_script_directory(config)
     if resolve_dependencies:
         heads = script.get_revisions("heads")
     else:
@@ -388,7 +404,7 @@ async def current(config: Config, verbose: bool = False) -> None:
 
     """
 
-    script = ScriptDirectory.from_config(config)
+    script = get_script_directory(config)
 
     def display_version(rev, context):
         if verbose:
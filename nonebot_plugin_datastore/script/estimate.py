@@ -0,0 +1,351 @@
+"""迁移开销估算
+
+迁移使用 `render_as_batch`，在 SQLite 中修改列等操作会复制整张表
+演练时不连接数据库执行迁移，只记录待执行迁移中的操作
+找出需要复制整张表或重建索引的操作，并统计受影响的表的行数与大小
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Optional
+
+import alembic.op
+from sqlalchemy import func, inspect, select, table, text
+from sqlalchemy.sql.elements import ClauseElement
+from sqlalchemy.sql.schema import Computed, DefaultClause
+
+from ..db import get_engine
+from .squash import load_baseline
+from .utils import get_current_revisions, get_script_directory
+
+if TYPE_CHECKING:
+    from alembic.config import Config
+    from sqlalchemy.engine import Connection
+
+COPY = "copy"
+"""需要复制整张表"""
+INDEX = "index"
+"""需要创建索引"""
+DATA = "data"
+"""执行 SQL 语句，无法估算开销"""
+
+KIND_NAMES = {COPY: "复制整张表", INDEX: "创建索引", DATA: "执行 SQL 语句"}
+
+# 第一个参数不是表名的操作，值为表名参数的位置
+TABLE_ARGUMENT_INDEX = {
+    "create_index": 1,
+    "create_unique_constraint": 1,
+    "create_primary_key": 1,
+    "create_foreign_key": 1,
+    "create_check_constraint": 1,
+    "drop_constraint": 1,
+}
+
+# SQLite 在 batch 模式中不需要复制表的操作
+SQLITE_BATCH_OPERATIONS = ("add_column", "create_index", "drop_index")
+
+
+class DryRunUnsupportedError(RuntimeError):
+    """迁移中使用了演练时无法提供的功能，例如获取数据库连接"""
+
+
+class RecordedOperation:
+    """记录的迁移操作"""
+
+    def __init__(
+        self,
+        name: str,
+        args: tuple,
+        kwargs: dict[str, Any],
+        batch: Optional[list["RecordedOperation"]] = None,
+    ) -> None:
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.batch = batch
+        """batch_alter_table 中的操作"""
+
+    @property
+    def table(self) -> Optional[str]:
+        """操作的表名"""
+        if self.name == "execute":
+            return None
+        if table_name := self.kwargs.get("table_name"):
+            return table_name
+        index = TABLE_ARGUMENT_INDEX.get(self.name, 0)
+        if len(self.args) > index and isinstance(self.args[index], str):
+            return self.args[index]
+
+
+class BatchRecorder:
+    """记录 batch_alter_table 中的操作"""
+
+    def __init__(self, operations: list[RecordedOperation]) -> None:
+        self._operations = operations
+
+    def __getattr__(self, name: str):
+        def record(*args, **kwargs):
+            self._operations.append(RecordedOperation(name, args, kwargs))
+
+        return record
+
+
+class OperationRecorder:
+    """代替 `alembic.op` 记录迁移中的操作，不会执行"""
+
+    def __init__(self) -> None:
+        self.operations: list[RecordedOperation] = []
+
+    def f(self, name: str) -> str:
+        return name
+
+    def get_bind(self):
+        raise DryRunUnsupportedError("演练时无法获取数据库连接")
+
+    def get_context(self):
+        raise DryRunUnsupportedError("演练时无法获取迁移上下文")
+
+    @contextmanager
+    def batch_alter_table(self, table_name: str, *args, **kwargs):
+        batch: list[RecordedOperation] = []
+        yield BatchRecorder(batch)
+        self.operations.append(
+            RecordedOperation("batch_alter_table", (table_name,), kwargs, batch)
+        )
+
+    def __getattr__(self, name: str):
+        def record(*args, **kwargs):
+            self.operations.append(RecordedOperation(name, args, kwargs))
+
+        return record
+
+
+@contextmanager
+def recording_operations() -> Iterator[OperationRecorder]:
+    """在上下文中用记录器代替 `alembic.op`
+
+    `Operations.context` 只接受迁移上下文，所以直接替换 `alembic.op` 的代理对象
+    依赖 Alembic 1.13 的实现：`alembic.op` 中的函数会调用模块中 `_proxy` 的同名方法
+    """
+    recorder = OperationRecorder()
+    previous = getattr(alembic.op, "_proxy", None)
+    alembic.op._proxy = recorder  # type: ignore
+    try:
+        yield recorder
+    finally:
+        alembic.op._proxy = previous  # type: ignore
+
+
+def record_operations(module: ModuleType) -> list[RecordedOperation]:
+    """记录迁移的 upgrade 函数中的操作"""
+    with recording_operations() as recorder:
+        module.upgrade()
+    return recorder.operations
+
+
+def _sqlite_requires_copy(batch: list[RecordedOperation]) -> bool:
+    """与 Alembic 的 SQLiteImpl.requires_recreate_in_batch 相同"""
+    for operation in batch:
+        if operation.name not in SQLITE_BATCH_OPERATIONS:
+            return True
+        if operation.name == "add_column":
+            column = operation.args[0] if operation.args else None
+            server_default = getattr(column, "server_default", None)
+            if isinstance(server_default, DefaultClause) and isinstance(
+                server_default.arg, ClauseElement
+            ):
+                return True
+            if isinstance(server_default, Computed) and server_default.persisted:
+                return True
+    return False
+
+
+def get_operation_kind(
+    dialect_name: str, operation: RecordedOperation
+) -> Optional[str]:
+    """获取操作的开销类型，不需要关注的操作返回 None"""
+    if operation.name == "batch_alter_table":
+        if dialect_name == "sqlite":
+            return COPY if _sqlite_requires_copy(operation.batch or []) else None
+        # 其他数据库会直接执行 batch 中的操作
+        kinds = {
+            get_operation_kind(dialect_name, batch_operation)
+            for batch_operation in operation.batch or []
+        }
+        for kind in (COPY, INDEX, DATA):
+            if kind in kinds:
+                return kind
+        return None
+    if operation.name in ("create_index", "create_unique_constraint"):
+        return INDEX
+    if operation.name == "alter_column" and (
+        dialect_name == "sqlite" or "type_" in operation.kwargs
+    ):
+        # 修改列的类型时，PostgreSQL 与 MySQL 也需要重写整张表
+        return COPY
+    if operation.name == "execute":
+        return DATA
+    return None
+
+
+class TableCost:
+    """单张表的迁移开销"""
+
+    def __init__(self, table: Optional[str]) -> None:
+        self.table = table
+        self.kinds: set[str] = set()
+        self.revisions: list[str] = []
+        self.rows: Optional[int] = None
+        self.size: Optional[int] = None
+        """表占用的空间，单位为字节，无法获取时为 None"""
+
+
+class RevisionEstimate:
+    """单个迁移的分析结果"""
+
+    def __init__(self, revision: str, message: str) -> None:
+        self.revision = revision
+        self.message = message
+        self.operations: list[RecordedOperation] = []
+        self.error: Optional[str] = None
+        """无法分析的原因"""
+
+
+class UpgradeEstimate:
+    """插件升级的开销估算"""
+
+    def __init__(self, plugin_name: str, dialect_name: str) -> None:
+        self.plugin_name = plugin_name
+        self.dialect_name = dialect_name
+        self.revisions: list[RevisionEstimate] = []
+        self.tables: dict[Optional[str], TableCost] = {}
+
+    @property
+    def heavy(self) -> bool:
+        """是否有需要复制整张表的操作"""
+        return any(COPY in cost.kinds for cost in self.tables.values())
+
+    def add(self, revision: str, operation: RecordedOperation) -> None:
+        if not (kind := get_operation_kind(self.dialect_name, operation)):
+            return
+        name = operation.table
+        if name not in self.tables:
+            self.tables[name] = TableCost(name)
+        cost = self.tables[name]
+        cost.kinds.add(kind)
+        if revision not in cost.revisions:
+            cost.revisions.append(revision)
+
+    def format(self) -> str:
+        """以文本形式展示估算结果"""
+        if not self.revisions:
+            return f"插件 {self.plugin_name} 的数据库已是最新版本"
+
+        lines = [f"插件 {self.plugin_name} 待执行的迁移:"]
+        for revision in self.revisions:
+            line = f"  {revision.revision} {revision.message}"
+            if revision.error:
+                line += f" (无法分析: {revision.error})"
+            lines.append(line)
+
+        if not self.tables:
+            lines.append("没有需要复制整张表或创建索引的操作")
+            return "\n".join(lines)
+
+        lines.append("受影响的表:")
+        for cost in self.tables.values():
+            kinds = "、".join(KIND_NAMES[kind] for kind in sorted(cost.kinds))
+            rows = "未知" if cost.rows is None else str(cost.rows)
+            size = "未知" if cost.size is None else _format_size(cost.size)
+            lines.append(
+                f"  {cost.table or '-'}: {kinds}，{rows} 行，约 {size}，"
+                f"迁移: {', '.join(cost.revisions)}"
+            )
+        return "\n".join(lines)
+
+
+def _format_size(size: int) -> str:
+    value = float(size)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024 or unit == "GiB":
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GiB"  # pragma: no cover
+
+
+def _get_table_size(connection: "Connection", name: str) -> Optional[int]:
+    """获取表占用的空间，不支持时返回 None"""
+    dialect_name = connection.dialect.name
+    if dialect_name == "sqlite":
+        # 需要 SQLite 编译时启用 dbstat 虚拟表
+        statement = text("SELECT SUM(pgsize) FROM dbstat WHERE name = :name")
+    elif dialect_name == "postgresql":
+        statement = text("SELECT pg_total_relation_size(:name)")
+    elif dialect_name in ("mysql", "mariadb"):
+        statement = text(
+            "SELECT data_length + index_length FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = :name"
+        )
+    else:
+        return None
+
+    try:
+        with connection.begin_nested():
+            size = connection.execute(statement, {"name": name}).scalar()
+    except Exception:
+        return None
+    return None if size is None else int(size)
+
+
+def _fill_table_stats(connection: "Connection", estimate: UpgradeEstimate) -> None:
+    existing = set(inspect(connection).get_table_names())
+    for cost in estimate.tables.values():
+        if cost.table is None:
+            continue
+        if cost.table not in existing:
+            # 迁移中新建的表
+            cost.rows = cost.size = 0
+            continue
+        cost.rows = connection.execute(
+            select(func.count()).select_from(table(cost.table))
+        ).scalar_one()
+        cost.size = _get_table_size(connection, cost.table)
+
+
+async def estimate_upgrade(config: "Config", revision: str = "head") -> UpgradeEstimate:
+    """估算升级到指定版本的开销，不会修改数据库"""
+    plugin_name = config.get_main_option("plugin_name")
+    assert plugin_name
+    engine = get_engine(plugin_name)
+    estimate = UpgradeEstimate(plugin_name, engine.dialect.name)
+
+    script = get_script_directory(config)
+    current = (await get_current_revisions([plugin_name]))[plugin_name]
+
+    modules: list[tuple[str, str, ModuleType]] = []
+    lower: tuple[str, ...] = tuple(current)
+    # 新安装时与升级一样优先使用基线迁移
+    if not current and revision in ("head", "heads"):
+        if baseline := load_baseline(config):
+            modules.append((baseline.revision, "基线迁移", baseline))
+            lower = (baseline.revision,)
+    scripts = reversed(
+        list(script.iterate_revisions(revision, lower, implicit_base=True))
+    )
+    modules.extend((item.revision, item.doc, item.module) for item in scripts)
+
+    for rev, message, module in modules:
+        revision_estimate = RevisionEstimate(rev, message)
+        estimate.revisions.append(revision_estimate)
+        try:
+            revision_estimate.operations = record_operations(module)
+        except Exception as e:
+            revision_estimate.error = str(e)
+        for operation in revision_estimate.operations:
+            estimate.add(rev, operation)
+
+    if estimate.tables:
+        async with engine.connect() as connection:
+            await connection.run_sync(_fill_table_stats, estimate)
+    return estimate
@@ -0,0 +1,198 @@
+"""合并迁移文件
+
+插件的迁移文件越来越多时，新安装需要依次执行所有迁移
+使用 `render_as_batch` 时 SQLite 的每次表结构修改都会复制整张表
+合并后的基线迁移直接创建最终的表结构，并将数据库版本标记为基线对应的版本
+旧的迁移文件仍然保留，已有的数据库继续按原来的迁移文件升级
+
+基线根据模型生成，迁移文件中修改数据的操作，以及自动生成迁移时不会比较的
+服务器默认值与 CHECK 约束都无法重现，存在这些操作时需确认后才能合并
+"""
+
+from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Optional
+
+from alembic.autogenerate import render_python_code
+from alembic.operations import ops
+from alembic.util.exc import CommandError
+from alembic.util.pyfiles import load_module_py
+from nonebot.log import logger
+from sqlalchemy import CheckConstraint, Column
+
+from ..db import get_table_plugin_name
+from ..plugin import PluginData
+from .utils import get_script_directory
+
+if TYPE_CHECKING:
+    from alembic.config import Config
+
+    from .estimate import RecordedOperation
+
+BASELINE_DIRNAME = "baseline"
+"""基线迁移所在的文件夹，位于迁移文件夹中，Alembic 不会将其当作迁移文件加载"""
+BASELINE_FILENAME = "baseline.py"
+
+BASELINE_TEMPLATE = '''"""插件 {plugin} 的基线迁移
+
+由 nb datastore squash 生成，等同于版本 {revision}
+新安装时直接执行此迁移，并将数据库版本标记为 {revision}
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# 基线对应的版本
+revision = "{revision}"
+
+
+def upgrade() -> None:
+    {upgrades}
+'''
+
+
+def get_baseline_file(plugin_name: str) -> Optional[Path]:
+    """获取插件基线迁移文件的位置"""
+    if migration_dir := PluginData(plugin_name).migration_dir:
+        return migration_dir / BASELINE_DIRNAME / BASELINE_FILENAME
+
+
+def render_baseline(plugin_name: str, revision: str) -> str:
+    """根据插件的模型生成基线迁移"""
+    metadata = PluginData(plugin_name).metadata
+    if metadata is None:
+        raise ValueError(f"插件 {plugin_name} 未使用数据库")
+
+    upgrade_ops = ops.UpgradeOps([])
+    for table in metadata.sorted_tables:
+        if get_table_plugin_name(table) != plugin_name:
+            continue
+        upgrade_ops.ops.append(ops.CreateTableOp.from_table(table))
+        upgrade_ops.ops.extend(
+            ops.CreateIndexOp.from_index(index)
+            for index in sorted(table.indexes, key=lambda index: index.name or "")
+        )
+
+    upgrades = render_python_code(upgrade_ops)
+    return BASELINE_TEMPLATE.format(
+        plugin=plugin_name, revision=revision, upgrades=upgrades
+    )
+
+
+DATA_OPERATIONS = ("execute", "bulk_insert")
+"""修改数据的操作"""
+
+
+def _has_schema_details(item: Any) -> Optional[str]:
+    """列或约束中自动生成迁移时不会比较的内容"""
+    if isinstance(item, CheckConstraint):
+        return "CHECK 约束"
+    if isinstance(item, Column):
+        if item.server_default is not None:
+            return "服务器默认值"
+        if any(isinstance(c, CheckConstraint) for c in item.constraints):
+            return "CHECK 约束"
+
+
+def get_unreproducible_reason(operation: "RecordedOperation") -> Optional[str]:
+    """获取基线无法重现该操作的原因，可以重现时返回 None"""
+    if operation.name in DATA_OPERATIONS:
+        return "修改数据"
+    if operation.name == "create_check_constraint":
+        return "CHECK 约束"
+    if operation.name == "alter_column" and "server_default" in operation.kwargs:
+        return "服务器默认值"
+    if operation.name in ("create_table", "add_column"):
+        for arg in operation.args:
+            if reason := _has_schema_details(arg):
+                return reason
+    for batch_operation in operation.batch or []:
+        if reason := get_unreproducible_reason(batch_operation):
+            return reason
+
+
+def find_unreproducible_operations(config: "Config") -> list[str]:
+    """找出插件迁移文件中基线无法重现的操作
+
+    返回每个操作的说明，无法分析的迁移也会包含在内
+    """
+    from .estimate import recording_operations
+
+    problems = []
+    script = get_script_directory(config)
+    for revision in reversed(list(script.walk_revisions())):
+        try:
+            with recording_operations() as recorder:
+                revision.module.upgrade()
+        except Exception as e:
+            problems.append(f"{revision.revision}: 无法分析 ({e})")
+            continue
+        for operation in recorder.operations:
+            if reason := get_unreproducible_reason(operation):
+                problems.append(f"{revision.revision}: {operation.name} ({reason})")
+    return problems
+
+
+def generate_baseline(config: "Config", force: bool = False) -> Path:
+    """生成插件的基线迁移
+
+    基线对应插件迁移文件的最新版本，需要保证模型与迁移文件一致
+    迁移文件中有基线无法重现的操作时报错，`force` 为 True 时仍然生成
+    返回基线迁移文件的位置
+    """
+    plugin_name = config.get_main_option("plugin_name")
+    assert plugin_name
+    baseline_file = get_baseline_file(plugin_name)
+    if baseline_file is None:
+        raise ValueError(f"插件 {plugin_name} 没有迁移文件夹")
+
+    revision = get_script_directory(config).get_current_head()
+    if revision is None:
+        raise ValueError(f"插件 {plugin_name} 没有迁移文件")
+
+    if problems := find_unreproducible_operations(config):
+        message = f"插件 {plugin_name} 的迁移文件中有基线无法重现的操作:\n" + "\n".join(
+            f"  {problem}" for problem in problems
+        )
+        if not force:
+            raise ValueError(
+                f"{message}\n新安装的数据库将与升级的数据库不同，"
+                "确认模型中已包含这些内容且不需要这些数据后，可使用 --force 生成"
+            )
+        logger.warning(message)
+
+    baseline_file.parent.mkdir(parents=True, exist_ok=True)
+    baseline_file.write_text(render_baseline(plugin_name, revision), encoding="utf8")
+    return baseline_file
+
+
+# 基线迁移文件对应的模块，值为文件的修改时间和大小与模块
+_baselines: dict[Path, tuple[tuple[int, int], ModuleType]] = {}
+
+
+def load_baseline(config: "Config") -> Optional[ModuleType]:
+    """加载插件的基线迁移
+
+    同一个基线迁移文件在进程中只会导入一次，文件变化后重新导入
+    基线对应的版本不在迁移文件中时不使用
+    """
+    plugin_name = config.get_main_option("plugin_name")
+    assert plugin_name
+    baseline_file = get_baseline_file(plugin_name)
+    if baseline_file is None or not baseline_file.exists():
+        return
+
+    stat = baseline_file.stat()
+    fingerprint = (stat.st_mtime_ns, stat.st_size)
+    cached = _baselines.get(baseline_file)
+    if cached and cached[0] == fingerprint:
+        module = cached[1]
+    else:
+        module = load_module_py(f"datastore_baseline_{plugin_name}", str(baseline_file))
+        _baselines[baseline_file] = (fingerprint, module)
+    try:
+        get_script_directory(config).get_revision(module.revision)
+    except (AttributeError, CommandError):
+        logger.warning(f"插件 {plugin_name} 的基线迁移对应的版本不存在，已忽略")
+        return
+    return module
@@ -1,10 +1,17 @@
+import hashlib
+import json
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import TYPE_CHECKING, Optional
 
 from alembic import context
 from alembic.config import Config as AlembicConfig
+from alembic.script import ScriptDirectory
 from nonebot import get_loaded_plugins, get_plugin
 from nonebot.log import logger
+from sqlalchemy import String, column, inspect, literal, select, table, union_all
 
 from ..db import get_engine
 from ..plugin import PluginData
@@ -12,7 +19,11 @@ from ..plugin import PluginData
 if TYPE_CHECKING:
     from nonebot.plugin import Plugin
 
+    from ..profile import PluginProfile
+    from sqlalchemy.ext.asyncio.engine import AsyncConnection, AsyncEngine
+
 SCRIPT_LOCATION = Path(__file__).parent / "migration"
+HEADS_CACHE_FILENAME = "migration_heads.json"
 
 
 def get_plugins(name: Optional[str] = None, exclude_others: bool = False) -> list[str]:
@@ -60,6 +71,145 @@ class Config(AlembicConfig):
         self.set_main_option("version_path_separator", "os")
 
 
+def get_migration_fingerprint(migration_dir: Optional[Path]) -> str:
+    """获取迁移文件夹的指纹
+
+    根据迁移文件的文件名、修改时间和大小计算，任意迁移文件变化后指纹都会改变
+    """
+    if not migration_dir or not migration_dir.is_dir():
+        return ""
+
+    files = []
+    for path in sorted(migration_dir.glob("*.py")):
+        stat = path.stat()
+        files.append((path.name, stat.st_mtime_ns, stat.st_size))
+    return hashlib.sha1(json.dumps(files).encode()).hexdigest()
+
+
+# 迁移文件夹对应的迁移脚本目录，值为迁移文件夹的指纹与迁移脚本目录
+_script_directories: dict[str, tuple[str, ScriptDirectory]] = {}
+
+
+def get_script_directory(config: AlembicConfig) -> ScriptDirectory:
+    """获取迁移脚本目录
+
+    同一个迁移文件夹在进程中只会加载一次，迁移文件变化后重新加载
+    迁移文件会在第一次读取版本信息时才导入
+    """
+    version_locations = config.get_main_option("version_locations") or ""
+    fingerprint = get_migration_fingerprint(Path(version_locations))
+    cached = _script_directories.get(version_locations)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    script = ScriptDirectory.from_config(config)
+    _script_directories[version_locations] = (fingerprint, script)
+    return script
+
+
+def get_head_revisions(plugin_names: list[str]) -> dict[str, set[str]]:
+    """获取插件迁移文件的最新版本
+
+    结果缓存在缓存目录中，迁移文件未发生变化时不用再加载迁移文件
+    """
+    cache_file = PluginData("nonebot_plugin_datastore").cache_dir / HEADS_CACHE_FILENAME
+    try:
+        cache = json.loads(cache_file.read_text(encoding="utf8"))
+    except (OSError, ValueError):
+        cache = {}
+
+    heads: dict[str, set[str]] = {}
+    changed = False
+    for plugin_name in plugin_names:
+        migration_dir = PluginData(plugin_name).migration_dir
+        fingerprint = get_migration_fingerprint(migration_dir)
+        cached = cache.get(plugin_name)
+        if (
+            cached
+            and cached.get("migration_dir") == str(migration_dir)
+            and cached.get("fingerprint") == fingerprint
+        ):
+            heads[plugin_name] = set(cached["heads"])
+            continue
+
+        script = get_script_directory(Config(plugin_name))
+        heads[plugin_name] = set(script.get_heads())
+        cache[plugin_name] = {
+            "migration_dir": str(migration_dir),
+            "fingerprint": fingerprint,
+            "heads": sorted(heads[plugin_name]),
+        }
+        changed = True
+
+    if changed:
+        try:
+            cache_file.write_text(json.dumps(cache), encoding="utf8")
+        except OSError as e:
+            # 缓存只用于加快启动，写入失败时下次启动重新计算即可
+            logger.warning(f"写入迁移文件最新版本的缓存失败: {e}")
+    return heads
+
+
+def _get_current_revisions(connection, plugin_names: list[str]):
+    version_tables = {f"{name}_alembic_version": name for name in plugin_names}
+    existing = set(inspect(connection).get_table_names()) & version_tables.keys()
+
+    revisions: dict[str, set[str]] = {name: set() for name in plugin_names}
+    statements = [
+        select(
+            literal(version_tables[table_name], String).label("plugin_name"),
+            table(table_name, column("version_num")).c.version_num,
+        )
+        for table_name in sorted(existing)
+    ]
+    if statements:
+        for plugin_name, version in connection.execute(union_all(*statements)):
+            revisions[plugin_name].add(version)
+    return revisions
+
+
+async def get_current_revisions(plugin_names: list[str]) -> dict[str, set[str]]:
+    """获取插件数据库的当前版本
+
+    每个数据库只需一次查询就能读取所有插件的 alembic_version 表
+    """
+    engines: dict[AsyncEngine, list[str]] = {}
+    for plugin_name in plugin_names:
+        engines.setdefault(get_engine(plugin_name), []).append(plugin_name)
+
+    revisions: dict[str, set[str]] = {}
+    for engine, names in engines.items():
+        async with engine.connect() as connection:
+            revisions.update(await connection.run_sync(_get_current_revisions, names))
+    return revisions
+
+
+def _setup_migration_profile(profile: "PluginProfile") -> None:
+    """记录读取数据库当前版本与每个迁移的耗时"""
+    migration_context = context.get_context()
+    last = time.perf_counter()
+
+    get_current_heads = migration_context.get_current_heads
+
+    def timed_get_current_heads():
+        nonlocal last
+        start = time.perf_counter()
+        try:
+            return get_current_heads()
+        finally:
+            last = time.perf_counter()
+            profile.add("version_lookup", last - start)
+
+    def on_version_apply(ctx, step, heads, run_args):
+        nonlocal last
+        now = time.perf_counter()
+        profile.add_revision(step.up_revision_id, now - last)
+        last = now
+
+    migration_context.get_current_heads = timed_get_current_heads
+    migration_context.on_version_apply_callbacks = (on_version_apply,)
+
+
 def do_run_migrations(connection, plugin_name: Optional[str] = None):
     config = context.config
 
@@ -110,13 +260,63 @@ def do_run_migrations(connection, plugin_name: Optional[str] = None):
         compare_type=True,
     )
 
+    if profile := config.attributes.get("profile"):
+        _setup_migration_profile(profile)
+
     with context.begin_transaction():
         context.run_migrations()
 
 
 async def run_migration(plugin_name: Optional[str] = None):
-    """运行迁移"""
-    connectable = get_engine()
+    """运行迁移
+
+    `config.attributes` 中有 `connection` 时直接使用该连接，不再单独打开连接
+    """
+    if plugin_name is None:
+        plugin_name = context.config.get_main_option("plugin_name")
+    if connection := context.config.attributes.get("connection"):
+        # 连接已在外层开启事务，迁移不会再单独开启事务
+        await connection.run_sync(do_run_migrations, plugin_name)
+        return
+
+    connectable = get_engine(plugin_name)
+    profile = context.config.attributes.get("profile")
 
+    start = time.perf_counter()
     async with connectable.connect() as connection:
+        if profile:
+            profile.add("connect", time.perf_counter() - start)
         await connection.run_sync(do_run_migrations, plugin_name)
+
+
+def _set_isolation_level(connection, level: Optional[str]) -> Optional[str]:
+    """设置驱动的事务隔离级别，返回原来的值"""
+    dbapi_connection = connection.connection.dbapi_connection
+    previous = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = level
+    return previous
+
+
+@asynccontextmanager
+async def migration_connection(
+    engine: "AsyncEngine",
+) -> AsyncIterator["AsyncConnection"]:
+    """打开批量迁移使用的连接，并开启包含所有迁移的事务
+
+    退出时提交事务，出现异常时回滚
+    """
+    async with engine.connect() as connection:
+        is_sqlite = engine.dialect.name == "sqlite"
+        if is_sqlite:
+            # sqlite3 驱动只会在 DML 语句前自动开启事务，DDL 与 SAVEPOINT 无法回滚
+            # 关闭驱动的事务管理，手动发出 BEGIN
+            # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+            level = await connection.run_sync(_set_isolation_level, None)
+        try:
+            async with connection.begin():
+                if is_sqlite:
+                    await connection.exec_driver_sql("BEGIN")
+                yield connection
+        finally:
+            if is_sqlite:
+                await connection.run_sync(_set_isolation_level, level)  # type: ignore
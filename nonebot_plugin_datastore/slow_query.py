@@ -0,0 +1,143 @@
+"""慢查询日志
+
+记录执行时间超过阈值的语句，并根据表名判断语句所属的插件
+"""
+
+import json
+import logging
+import re
+import time
+from logging.handlers import RotatingFileHandler
+from typing import TYPE_CHECKING, Any, Optional
+
+from nonebot.log import logger
+from sqlalchemy import event
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio.engine import AsyncEngine
+
+SLOW_QUERY_FILENAME = "slow_query.log"
+SLOW_QUERY_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_BACKUP_COUNT = 5
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+_slow_query_logger: Optional[logging.Logger] = None
+
+
+def get_slow_query_logger() -> logging.Logger:
+    """获取写入慢查询日志文件的 logger
+
+    日志文件位于数据目录下，超过 10 MiB 后轮换
+    """
+    global _slow_query_logger
+
+    if _slow_query_logger is None:
+        from .plugin import PluginData
+
+        path = PluginData("nonebot_plugin_datastore").data_dir / SLOW_QUERY_FILENAME
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=SLOW_QUERY_MAX_BYTES,
+            backupCount=SLOW_QUERY_BACKUP_COUNT,
+            encoding="utf8",
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _slow_query_logger = logging.getLogger("nonebot_plugin_datastore.slow_query")
+        _slow_query_logger.setLevel(logging.INFO)
+        _slow_query_logger.propagate = False
+        for old_handler in _slow_query_logger.handlers:
+            old_handler.close()
+        _slow_query_logger.handlers = [handler]
+    return _slow_query_logger
+
+
+def get_table_plugin_map() -> dict[str, str]:
+    """获取所有插件模型的表名与插件名的对应关系"""
+    from .plugin import PluginData
+
+    table_map = {}
+    for plugin_data in PluginData._instances.values():
+        if not (metadata := plugin_data.metadata):
+            continue
+        if plugin_name_map := metadata.info.get("plugin_name_map"):
+            table_map.update(plugin_name_map)
+        if name := metadata.info.get("name"):
+            table_map.update(dict.fromkeys(metadata.tables, name))
+    return table_map
+
+
+def resolve_plugin_names(statement: str) -> list[str]:
+    """根据语句中的表名判断语句所属的插件
+
+    表名规则为 插件名_表名，无法直接找到的表名会尝试按最长的插件名前缀匹配
+    """
+    table_map = get_table_plugin_map()
+    plugin_names = sorted(set(table_map.values()), key=len, reverse=True)
+
+    result = []
+    for identifier in dict.fromkeys(IDENTIFIER_PATTERN.findall(statement)):
+        plugin_name = table_map.get(identifier)
+        if plugin_name is None:
+            plugin_name = next(
+                (name for name in plugin_names if identifier.startswith(f"{name}_")),
+                None,
+            )
+        if plugin_name and plugin_name not in result:
+            result.append(plugin_name)
+    return result
+
+
+def get_parameters_shape(parameters: Any, executemany: bool) -> dict[str, Any]:
+    """获取参数的结构，不记录参数的值"""
+    if executemany:
+        rows = list(parameters or [])
+        shape = {"executemany": True, "rows": len(rows)}
+        if rows:
+            shape["row"] = get_parameters_shape(rows[0], False)
+        return shape
+    if isinstance(parameters, dict):
+        return {"type": "dict", "keys": sorted(parameters)}
+    if isinstance(parameters, (list, tuple)):
+        return {"type": type(parameters).__name__, "length": len(parameters)}
+    return {"type": type(parameters).__name__}
+
+
+def setup_slow_query_log(engine: "AsyncEngine", name: str, threshold: float) -> None:
+    """记录数据库引擎中执行时间超过 `threshold` 秒的语句"""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("datastore_slow_query_start", []).append(
+            time.perf_counter()
+        )
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["datastore_slow_query_start"].pop()
+        if duration < threshold:
+            return
+
+        plugin_names = resolve_plugin_names(statement)
+        record = {
+            "time": time.time(),
+            "engine": name,
+            "plugins": plugin_names,
+            "duration": duration,
+            "statement": statement,
+            "parameters": get_parameters_shape(parameters, executemany),
+        }
+        get_slow_query_logger().info(json.dumps(record, ensure_ascii=False))
+        logger.warning(
+            f"慢查询 {duration:.3f}s，所属插件: {', '.join(plugin_names) or '未知'}"
+        )
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        if connection := exception_context.connection:
+            starts = connection.info.get("datastore_slow_query_start")
+            if starts:
+                starts.pop()
@@ -0,0 +1,85 @@
+"""SQLite 性能设置
+
+在每个新连接上执行 PRAGMA，调整日志模式、同步级别等设置
+"""
+
+from typing import TYPE_CHECKING, Any
+
+from nonebot.log import logger
+from sqlalchemy import event
+
+from .config import plugin_config
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio.engine import AsyncEngine
+
+SQLITE_PROFILES: dict[str, dict[str, Any]] = {
+    "performance": {
+        # 读写互不阻塞
+        "journal_mode": "WAL",
+        # WAL 模式下 NORMAL 也不会损坏数据库，只是断电时可能丢失最近的事务
+        "synchronous": "NORMAL",
+        # 数据库被锁定时等待 5 秒，而不是直接报错
+        "busy_timeout": 5000,
+        # 负数单位为 KiB，即 64 MiB
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+"""内置的 SQLite 配置方案"""
+
+# 读取当前设置时始终包含的 PRAGMA
+INSPECTED_PRAGMAS = (
+    "journal_mode",
+    "synchronous",
+    "busy_timeout",
+    "cache_size",
+    "mmap_size",
+    "temp_store",
+)
+
+
+def get_sqlite_pragmas() -> dict[str, Any]:
+    """获取配置的 PRAGMA
+
+    先应用 `datastore_sqlite_profile` 对应的配置方案
+    再用 `datastore_sqlite_pragmas` 覆盖
+    """
+    pragmas = {}
+    if profile := plugin_config.datastore_sqlite_profile:
+        if profile not in SQLITE_PROFILES:
+            raise ValueError(f"未知的 SQLite 配置方案: {profile}")
+        pragmas.update(SQLITE_PROFILES[profile])
+    pragmas.update(plugin_config.datastore_sqlite_pragmas)
+
+    for name in pragmas:
+        if not name.isidentifier():
+            raise ValueError(f"无效的 PRAGMA 名称: {name}")
+    return pragmas
+
+
+def setup_sqlite_pragmas(engine: "AsyncEngine", pragmas: dict[str, Any]) -> None:
+    """在数据库引擎的每个新连接上执行 PRAGMA"""
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    logger.debug(f"SQLite PRAGMA: {pragmas}")
+
+
+async def get_applied_pragmas(engine: "AsyncEngine") -> dict[str, Any]:
+    """读取数据库连接当前生效的 PRAGMA"""
+    names = list(INSPECTED_PRAGMAS)
+    names.extend(name for name in get_sqlite_pragmas() if name not in names)
+
+    applied = {}
+    async with engine.connect() as connection:
+        for name in names:
+            result = await connection.exec_driver_sql(f"PRAGMA {name}")
+            applied[name] = result.scalar()
+    return applied
@@ -0,0 +1,118 @@
+"""SQLite 写入队列
+
+SQLite 同一时间只允许一个写入者，多个会话同时写入时会互相争抢写锁
+开启写入队列后，所有写入事务都会通过同一个写入连接按顺序执行
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Optional
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class WriteQueueStats:
+    """写入队列统计"""
+
+    def __init__(self, samples: int = 1000) -> None:
+        self.depth = 0
+        """当前正在等待写入连接的事务数"""
+        self.max_depth = 0
+        """等待写入连接的最大事务数"""
+        self.count = 0
+        """获取写入连接的总次数"""
+        self.total_wait = 0.0
+        """等待写入连接的总时间"""
+        self.max_wait = 0.0
+        """等待写入连接的最长时间"""
+        # 最近的等待时间，用于计算分位数
+        self._waits: deque[float] = deque(maxlen=samples)
+
+    def enter(self) -> None:
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def leave(self, wait: float) -> None:
+        self.depth -= 1
+        self.count += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._waits.append(wait)
+
+    def percentile(self, percent: float) -> float:
+        """最近等待时间的分位数"""
+        if not self._waits:
+            return 0.0
+        waits = sorted(self._waits)
+        index = min(len(waits) - 1, int(len(waits) * percent / 100))
+        return waits[index]
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "count": self.count,
+            "total_wait": self.total_wait,
+            "avg_wait": self.total_wait / self.count if self.count else 0.0,
+            "max_wait": self.max_wait,
+            "p50_wait": self.percentile(50),
+            "p99_wait": self.percentile(99),
+        }
+
+
+write_queue_stats = WriteQueueStats()
+
+
+class WriterPool(AsyncAdaptedQueuePool):
+    """写入连接池
+
+    需配合 `pool_size=1, max_overflow=0` 使用，等待连接的事务按先后顺序获取连接
+    写入连接被某个任务占用时，该任务再次获取写入连接会直接报错，而不是等到超时
+    """
+
+    _owner: Optional["asyncio.Task"] = None
+    """占用写入连接的任务"""
+
+    def _do_get(self):
+        task = _current_task()
+        if task is not None and task is self._owner:
+            raise RuntimeError(
+                "当前任务已占用写入连接，无法同时开启另一个写入事务，"
+                "请先提交之前的 session，或在同一个 session 中写入"
+            )
+        write_queue_stats.enter()
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        finally:
+            write_queue_stats.leave(time.perf_counter() - start)
+        self._owner = task
+        return record
+
+    def _do_return_conn(self, record) -> None:
+        self._owner = None
+        super()._do_return_conn(record)
+
+
+def _current_task() -> Optional["asyncio.Task"]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+WRITER_ENGINE_OPTIONS: dict[str, Any] = {
+    "poolclass": WriterPool,
+    "pool_size": 1,
+    "max_overflow": 0,
+}
+"""写入引擎的连接池参数"""
+
+
+def get_write_queue_stats() -> dict[str, Any]:
+    """获取写入队列的统计信息
+
+    时间单位为秒
+    """
+    return write_queue_stats.as_dict()
@@ -0,0 +1,19 @@
+from datetime import date
+
+from sqlalchemy.orm import Mapped, mapped_column
+
+from nonebot_plugin_datastore import get_plugin_data
+
+plugin_data = get_plugin_data()
+
+
+class MessageCount(plugin_data.Model):
+    """每天的消息数"""
+
+    group_id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
+
+
+counter = plugin_data.counter(MessageCount)
@@ -1,7 +1,10 @@
+from functools import partial
+
 from nonebot import on_command
 from nonebot.params import Depends
+from sqlalchemy import select
 
-from nonebot_plugin_datastore import get_session
+from nonebot_plugin_datastore import get_event_session, get_session
 from nonebot_plugin_datastore.db import AsyncSession, create_session, post_db_init
 
 from .models import Example
@@ -23,3 +26,54 @@ async def test_handle(session: AsyncSession = Depends(get_session)):
     example = Example(message="matcher")
     session.add(example)
     await session.commit()
+
+
+count = on_command("count")
+
+
+@count.handle()
+async def count_handle(
+    session: AsyncSession = Depends(partial(get_session, readonly=True)),
+):
+    examples = (await session.scalars(select(Example))).all()
+    await count.finish(str(len(examples)))
+
+
+event_add = on_command("event", priority=1, block=False)
+
+
+@event_add.handle()
+async def event_add_handle(session: AsyncSession = Depends(get_event_session)):
+    session.add(Example(message="event"))
+
+
+event_count = on_command("event", priority=2)
+
+
+@event_count.handle()
+async def event_count_handle(session: AsyncSession = Depends(get_event_session)):
+    # 与 event_add 共用一个 session，可以读取到尚未提交的数据
+    examples = (await session.scalars(select(Example))).all()
+    await event_count.finish(str(len(examples)))
+
+
+# 同一优先级的事件响应器会同时运行
+event_same_first = on_command("event_same", priority=3, block=False)
+event_same_second = on_command("event_same", priority=3, block=False)
+
+
+@event_same_first.handle()
+@event_same_second.handle()
+async def event_same_handle(session: AsyncSession = Depends(get_event_session)):
+    for _ in range(5):
+        session.add(Example(message="same"))
+        await session.flush()
+        await session.scalars(select(Example))
+
+
+session_info = on_command("session_info")
+
+
+@session_info.handle()
+async def session_info_handle(session: AsyncSession = Depends(get_session)):
+    await session_info.finish(str(session.info))
@@ -0,0 +1,265 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from nonebot import require
+from nonebug import App
+
+
+async def _add_examples(count: int) -> None:
+    from nonebot_plugin_datastore.db import create_session
+
+    from .example.plugin1 import Example
+
+    async with create_session() as session:
+        session.add_all([Example(message=f"message {i}") for i in range(count)])
+        await session.commit()
+
+
+async def _run_backfill(table_name: str = "plugin1_example", **kwargs) -> int:
+    """在迁移上下文中运行回填"""
+    from alembic.operations import Operations
+    from alembic.runtime.migration import MigrationContext
+
+    from nonebot_plugin_datastore.db import get_engine
+    from nonebot_plugin_datastore.script.backfill import backfill
+
+    def run(connection) -> int:
+        context = MigrationContext.configure(connection)
+        with Operations.context(context):
+            return backfill(table_name, **kwargs)
+
+    async with get_engine().connect() as connection:
+        return await connection.run_sync(run)
+
+
+BACKFILL_MIGRATION = '''"""backfill"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from nonebot_plugin_datastore.script.backfill import backfill, backfill_table
+
+revision = "d1e2f3a4b5c6"
+down_revision = "b6475c9488b6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    example = sa.table("plugin1_example", sa.column("message"))
+    op.bulk_insert(example, [{{"message": message}} for message in {messages}])
+    rows = backfill(
+        "plugin1_example",
+        sa.update(example).values(message=sa.func.upper(example.c.message)),
+    )
+    assert rows == {rows}
+
+    names = []
+
+    def process(connection, lower, upper):
+        names.extend(connection.execute(sa.select(backfill_table.c.name)).scalars())
+
+    backfill("plugin1_example", process)
+    # 默认的名称中包含迁移前的版本
+    assert names[-1] == "plugin1_alembic_version:b6475c9488b6:plugin1_example"
+
+
+def downgrade() -> None:
+    pass
+'''
+
+
+async def test_backfill_resume(app: App):
+    """测试回填中断后从上次的位置继续"""
+    from sqlalchemy import select, text
+
+    from nonebot_plugin_datastore.db import create_session, get_engine, init_db
+    from nonebot_plugin_datastore.script.backfill import backfill_table
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+    # 加上数据库初始化后添加的一行，共 5 行
+    await _add_examples(4)
+
+    ranges = []
+    interrupt = True
+
+    def process(connection, lower, upper):
+        ranges.append((lower, upper))
+        connection.execute(
+            text(
+                "UPDATE plugin1_example SET message = upper(message) "
+                "WHERE id BETWEEN :lower AND :upper"
+            ),
+            {"lower": lower, "upper": upper},
+        )
+        if interrupt and len(ranges) == 2:
+            raise ValueError("interrupted")
+
+    with pytest.raises(ValueError, match="interrupted"):
+        await _run_backfill(process=process, chunk_size=2, name="test")
+
+    # 第一批已经提交并记录进度
+    async with get_engine().connect() as connection:
+        checkpoint = (await connection.execute(select(backfill_table))).one()
+    assert checkpoint.name == "test"
+    assert checkpoint.last_key == "2"
+    assert checkpoint.rows == 2
+
+    ranges.clear()
+    interrupt = False
+    assert await _run_backfill(process=process, chunk_size=2, name="test") == 5
+    assert ranges == [(3, 4), (5, 5)]
+
+    async with create_session() as session:
+        messages = (await session.scalars(select(Example.message))).all()
+    assert messages == ["POST", "MESSAGE 0", "MESSAGE 1", "MESSAGE 2", "MESSAGE 3"]
+
+    # 完成后删除进度
+    async with get_engine().connect() as connection:
+        assert (await connection.execute(select(backfill_table))).all() == []
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_backfill_chunk_size": 2}, id="chunk_size")],
+    indirect=True,
+)
+async def test_backfill_migration(app: App, tmp_path: Path):
+    """测试在迁移文件中回填数据"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.db import create_session, init_db
+    from nonebot_plugin_datastore.script import command
+    from nonebot_plugin_datastore.script.utils import Config, get_current_revisions
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    migration_dir = tmp_path / "migrations"
+    PluginData("plugin1").set_migration_dir(migration_dir)
+    shutil.copytree(
+        Path(__file__).parent / "example" / "plugin1" / "migrations", migration_dir
+    )
+
+    await init_db()
+    await _add_examples(4)
+
+    (migration_dir / "d1e2f3a4b5c6_backfill.py").write_text(
+        BACKFILL_MIGRATION.format(messages=[], rows=5), encoding="utf8"
+    )
+
+    await command.upgrade(Config("plugin1"), "head")
+    assert await get_current_revisions(["plugin1"]) == {"plugin1": {"d1e2f3a4b5c6"}}
+
+    async with create_session() as session:
+        messages = (await session.scalars(select(Example.message))).all()
+    assert messages == ["POST", "MESSAGE 0", "MESSAGE 1", "MESSAGE 2", "MESSAGE 3"]
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {
+                "datastore_backfill_chunk_size": 2,
+                "datastore_migration_batch": "transaction",
+            },
+            id="batch",
+        )
+    ],
+    indirect=True,
+)
+async def test_backfill_migration_batch(app: App, tmp_path: Path):
+    """测试批量迁移时在外层的事务中回填数据"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.db import create_session, init_db
+    from nonebot_plugin_datastore.script.utils import get_current_revisions
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    migration_dir = tmp_path / "migrations"
+    PluginData("plugin1").set_migration_dir(migration_dir)
+    shutil.copytree(
+        Path(__file__).parent / "example" / "plugin1" / "migrations", migration_dir
+    )
+    (migration_dir / "d1e2f3a4b5c6_backfill.py").write_text(
+        BACKFILL_MIGRATION.format(messages=["a", "b", "c"], rows=3),
+        encoding="utf8",
+    )
+
+    await init_db()
+    assert await get_current_revisions(["plugin1"]) == {"plugin1": {"d1e2f3a4b5c6"}}
+
+    async with create_session() as session:
+        messages = (await session.scalars(select(Example.message))).all()
+    assert messages == ["A", "B", "C", "post"]
+
+
+async def test_backfill_composite_key(app: App):
+    """测试没有指定分批的列时，表的主键需为单独一列"""
+    from nonebot_plugin_datastore.db import init_db
+
+    require("tests.example.counter")
+
+    await init_db()
+
+    with pytest.raises(ValueError, match="主键不是单独一列"):
+        await _run_backfill(
+            "counter_messagecount", process=lambda *args: None, name="test"
+        )
+
+
+async def test_backfill_date_key(app: App):
+    """测试主键不是 JSON 支持的类型时记录进度"""
+    from datetime import date
+
+    from sqlalchemy import column, select, table, text, update
+
+    from nonebot_plugin_datastore.db import get_engine
+    from nonebot_plugin_datastore.script.backfill import backfill_table
+
+    days = [date(2024, 1, day) for day in range(1, 6)]
+    async with get_engine().begin() as connection:
+        await connection.execute(
+            text("CREATE TABLE backfill_day (day DATE PRIMARY KEY, message TEXT)")
+        )
+        await connection.execute(
+            text("INSERT INTO backfill_day VALUES (:day, 'message')"),
+            [{"day": day.isoformat()} for day in days],
+        )
+
+    ranges = []
+
+    def process(connection, lower, upper):
+        ranges.append((lower, upper))
+        if len(ranges) == 2:
+            raise ValueError("interrupted")
+
+    with pytest.raises(ValueError, match="interrupted"):
+        await _run_backfill("backfill_day", process=process, chunk_size=2, name="day")
+    assert ranges[0] == (days[0], days[1])
+
+    async with get_engine().connect() as connection:
+        checkpoint = (await connection.execute(select(backfill_table))).one()
+    assert checkpoint.last_key == '{"type": "date", "value": "2024-01-02"}'
+
+    example = table("backfill_day", column("message"))
+    statement = update(example).values(message="done")
+    rows = await _run_backfill(
+        "backfill_day", process=statement, chunk_size=2, name="day"
+    )
+    assert rows == 5
+
+    async with get_engine().connect() as connection:
+        result = await connection.execute(text("SELECT day, message FROM backfill_day"))
+        messages = [message for _, message in result.all()]
+    # 第一批在中断前已经处理完成，不会重新处理
+    assert messages == ["message", "message", "done", "done", "done"]
@@ -0,0 +1,94 @@
+import pytest
+from nonebot import require
+from nonebug import App
+from pytest_mock import MockerFixture
+
+
+async def test_bulk_insert(app: App, mocker: MockerFixture):
+    """测试批量插入"""
+    from sqlalchemy import func, select
+
+    from nonebot_plugin_datastore.bulk import bulk_insert
+    from nonebot_plugin_datastore.db import create_session, init_db
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    async with create_session() as session:
+        execute = mocker.spy(session, "execute")
+        count = await bulk_insert(
+            session,
+            Example,
+            [{"message": f"bulk{i}"} for i in range(5)],
+            chunk_size=2,
+        )
+        await session.commit()
+
+    assert count == 5
+    assert execute.call_count == 3
+
+    async with create_session() as session:
+        total = await session.scalar(select(func.count()).select_from(Example))
+        # 包括 post_db_init 中插入的一行
+        assert total == 6
+
+    async with create_session() as session:
+        assert await bulk_insert(session, Example, []) == 0
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_bulk_chunk_size": 3}, id="chunk_size")],
+    indirect=True,
+)
+async def test_bulk_upsert(app: App, mocker: MockerFixture):
+    """测试批量插入或更新"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore.bulk import bulk_upsert
+    from nonebot_plugin_datastore.db import create_session, init_db
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    async with create_session() as session:
+        execute = mocker.spy(session, "execute")
+        count = await bulk_upsert(
+            session,
+            Example,
+            [{"id": i, "message": f"upsert{i}"} for i in range(1, 6)],
+        )
+        await session.commit()
+
+    assert count == 5
+    assert execute.call_count == 2
+
+    async with create_session() as session:
+        examples = (await session.scalars(select(Example))).all()
+        assert [example.message for example in examples] == [
+            "upsert1",
+            "upsert2",
+            "upsert3",
+            "upsert4",
+            "upsert5",
+        ]
+
+    # 冲突时不更新
+    async with create_session() as session:
+        await bulk_upsert(
+            session,
+            Example,
+            [{"id": 1, "message": "ignored"}, {"id": 6, "message": "upsert6"}],
+            update_columns=[],
+        )
+        await session.commit()
+
+    async with create_session() as session:
+        examples = (await session.scalars(select(Example))).all()
+        assert len(examples) == 6
+        assert examples[0].message == "upsert1"
+        assert examples[5].message == "upsert6"
@@ -297,3 +297,265 @@ async def test_migrate_global_registry(app: App, tmp_path: Path):
     result = await run_sync(runner.invoke)(cli, ["migrate", "--name", "plugin3"])
     assert result.exit_code == 0
     assert result.output == ""
+
+
+@pytest.mark.anyio()
+async def test_script_directory_cache(app: App, tmp_path: Path):
+    """测试缓存迁移脚本目录"""
+    from nonebot import require
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.script.utils import Config, get_script_directory
+
+    require("tests.example.plugin_migrate")
+
+    migration_dir = tmp_path / "migrations"
+    PluginData("plugin_migrate").set_migration_dir(migration_dir)
+    shutil.copytree(
+        Path(__file__).parent / "example" / "plugin_migrate" / "migrations",
+        migration_dir,
+    )
+
+    script = get_script_directory(Config("plugin_migrate"))
+    assert script.get_heads() == ["b6475c9488b6"]
+    # 迁移文件未变化时使用缓存
+    assert get_script_directory(Config("plugin_migrate")) is script
+
+    # 迁移文件变化后重新加载
+    init = (migration_dir / "bef062d23d1f_init.py").read_text(encoding="utf8")
+    (migration_dir / "c8d1e2f3a4b5_next.py").write_text(
+        init.replace('revision = "b6475c9488b6"', 'revision = "c8d1e2f3a4b5"').replace(
+            "down_revision = None", 'down_revision = "b6475c9488b6"'
+        ),
+        encoding="utf8",
+    )
+
+    new_script = get_script_directory(Config("plugin_migrate"))
+    assert new_script is not script
+    assert new_script.get_heads() == ["c8d1e2f3a4b5"]
+
+
+@pytest.mark.anyio()
+async def test_squash(app: App, tmp_path: Path):
+    """测试合并迁移文件"""
+    from nonebot import require
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.db import get_engine, init_db
+    from nonebot_plugin_datastore.script import command
+    from nonebot_plugin_datastore.script.cli import cli, run_sync
+    from nonebot_plugin_datastore.script.squash import load_baseline
+    from nonebot_plugin_datastore.script.utils import Config, get_current_revisions
+
+    require("tests.example.plugin1")
+
+    migration_dir = tmp_path / "migrations"
+    PluginData("plugin1").set_migration_dir(migration_dir)
+    shutil.copytree(
+        Path(__file__).parent / "example" / "plugin1" / "migrations", migration_dir
+    )
+
+    runner = CliRunner()
+
+    # 数据库不是最新版本时无法生成
+    result = await run_sync(runner.invoke)(cli, ["squash", "--name", "plugin1"])
+    assert result.exit_code == 1
+    assert not (migration_dir / "baseline").exists()
+
+    await init_db()
+
+    result = await run_sync(runner.invoke)(cli, ["squash", "--name", "plugin1"])
+    assert result.exit_code == 0
+
+    baseline_file = migration_dir / "baseline" / "baseline.py"
+    baseline = baseline_file.read_text(encoding="utf8")
+    assert 'revision = "b6475c9488b6"' in baseline
+    assert "op.create_table('plugin1_example'," in baseline
+
+    # 基线迁移不会被当作迁移文件
+    result = await run_sync(runner.invoke)(cli, ["heads", "--name", "plugin1"])
+    assert result.exit_code == 0
+
+    # 基线迁移文件未变化时使用缓存，变化后重新导入
+    module = load_baseline(Config("plugin1"))
+    assert module
+    assert load_baseline(Config("plugin1")) is module
+    baseline_file.write_text(baseline + "\n# changed\n", encoding="utf8")
+    new_module = load_baseline(Config("plugin1"))
+    assert new_module
+    assert new_module is not module
+    assert new_module.revision == "b6475c9488b6"
+
+    await command.downgrade(Config("plugin1"), "base")
+
+    # 新安装时使用基线迁移，不再执行原来的迁移
+    for path in migration_dir.glob("*.py"):
+        content = path.read_text(encoding="utf8")
+        path.write_text(
+            content.replace(
+                "def upgrade() -> None:",
+                "def upgrade() -> None:\n    raise ValueError('should not run')",
+            ),
+            encoding="utf8",
+        )
+
+    await command.upgrade(Config("plugin1"), "head")
+    assert await get_current_revisions(["plugin1"]) == {"plugin1": {"b6475c9488b6"}}
+
+    async with get_engine().connect() as connection:
+        await connection.exec_driver_sql("SELECT id, message FROM plugin1_example")
+
+
+@pytest.mark.anyio()
+async def test_squash_unreproducible(app: App, tmp_path: Path):
+    """测试迁移文件中有基线无法重现的操作时不合并"""
+    from nonebot import require
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.db import init_db
+    from nonebot_plugin_datastore.script.cli import cli, run_sync
+
+    require("tests.example.plugin1")
+
+    migration_dir = tmp_path / "migrations"
+    PluginData("plugin1").set_migration_dir(migration_dir)
+    shutil.copytree(
+        Path(__file__).parent / "example" / "plugin1" / "migrations", migration_dir
+    )
+    (migration_dir / "c1d2e3f4a5b6_seed.py").write_text(
+        '''"""seed"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "c1d2e3f4a5b6"
+down_revision = "b6475c9488b6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    example = sa.table("plugin1_example", sa.column("message"))
+    op.bulk_insert(example, [{"message": "seed"}])
+    with op.batch_alter_table("plugin1_example") as batch_op:
+        batch_op.alter_column("message", server_default="")
+
+
+def downgrade() -> None:
+    pass
+''',
+        encoding="utf8",
+    )
+
+    await init_db()
+
+    runner = CliRunner()
+    result = await run_sync(runner.invoke)(cli, ["squash", "--name", "plugin1"])
+    assert result.exit_code == 1
+    assert "c1d2e3f4a5b6: bulk_insert (修改数据)" in str(result.exception)
+    assert "c1d2e3f4a5b6: batch_alter_table (服务器默认值)" in str(result.exception)
+    assert not (migration_dir / "baseline").exists()
+
+    result = await run_sync(runner.invoke)(
+        cli, ["squash", "--name", "plugin1", "--force"]
+    )
+    assert result.exit_code == 0
+    baseline = (migration_dir / "baseline" / "baseline.py").read_text(encoding="utf8")
+    assert 'revision = "c1d2e3f4a5b6"' in baseline
+
+
+@pytest.mark.anyio()
+async def test_upgrade_dry_run(app: App, tmp_path: Path):
+    """测试估算迁移的开销"""
+    from nonebot import require
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.db import create_session, init_db
+    from nonebot_plugin_datastore.script.cli import cli, run_sync
+    from nonebot_plugin_datastore.script.estimate import COPY, INDEX, estimate_upgrade
+    from nonebot_plugin_datastore.script.utils import Config, get_current_revisions
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    migration_dir = tmp_path / "migrations"
+    PluginData("plugin1").set_migration_dir(migration_dir)
+    shutil.copytree(
+        Path(__file__).parent / "example" / "plugin1" / "migrations", migration_dir
+    )
+
+    await init_db()
+    async with create_session() as session:
+        session.add_all([Example(message=str(i)) for i in range(3)])
+        await session.commit()
+
+    estimate = await estimate_upgrade(Config("plugin1"))
+    assert estimate.revisions == []
+    assert estimate.format() == "插件 plugin1 的数据库已是最新版本"
+
+    (migration_dir / "c1d2e3f4a5b6_alter.py").write_text(
+        """\"\"\"alter message\"\"\"
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "c1d2e3f4a5b6"
+down_revision = "b6475c9488b6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("plugin1_example", schema=None) as batch_op:
+        batch_op.alter_column("message", type_=sa.Text())
+    op.create_index(op.f("ix_plugin1_example_message"), "plugin1_example", ["message"])
+    op.create_table("plugin1_new", sa.Column("id", sa.Integer(), nullable=False))
+    with op.batch_alter_table("plugin1_new", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("name", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    pass
+""",
+        encoding="utf8",
+    )
+
+    estimate = await estimate_upgrade(Config("plugin1"))
+    assert [revision.revision for revision in estimate.revisions] == ["c1d2e3f4a5b6"]
+    assert estimate.heavy
+    assert list(estimate.tables) == ["plugin1_example"]
+    cost = estimate.tables["plugin1_example"]
+    assert cost.kinds == {COPY, INDEX}
+    assert cost.rows == 4
+
+    runner = CliRunner()
+    result = await run_sync(runner.invoke)(
+        cli, ["upgrade", "--name", "plugin1", "--dry-run"]
+    )
+    assert result.exit_code == 0
+    assert "c1d2e3f4a5b6 alter message" in result.output
+    assert "plugin1_example: 复制整张表、创建索引，4 行" in result.output
+
+    # 不会修改数据库
+    assert await get_current_revisions(["plugin1"]) == {"plugin1": {"b6475c9488b6"}}
+
+
+def test_record_operations_unsupported(app: App):
+    """测试演练时迁移获取数据库连接"""
+    from types import ModuleType
+
+    from alembic import op
+
+    from nonebot_plugin_datastore.script.estimate import (
+        DryRunUnsupportedError,
+        record_operations,
+    )
+
+    module = ModuleType("revision")
+    module.upgrade = lambda: op.get_bind()  # type: ignore
+
+    with pytest.raises(DryRunUnsupportedError, match="演练时无法获取数据库连接"):
+        record_operations(module)
+
+    # 出错后恢复原来的代理对象
+    assert getattr(op, "_proxy", None) is None
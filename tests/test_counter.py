@@ -0,0 +1,149 @@
+from datetime import date
+
+import pytest
+from nonebot import require
+from nonebug import App
+from pytest_mock import MockerFixture
+
+
+async def test_counter(app: App):
+    """测试计数器"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.db import create_session, init_db
+
+    require("tests.example.counter")
+    from .example.counter import MessageCount, counter
+
+    await init_db()
+
+    assert PluginData("counter").counter(MessageCount) is counter
+
+    today = date(2024, 1, 1)
+    counter.increment(group_id=1, user_id=1, day=today)
+    counter.increment(2, group_id=1, user_id=1, day=today)
+    counter.increment(group_id=1, user_id=2, day=today)
+
+    # 尚未写入数据库
+    async with create_session() as session:
+        assert (await session.scalars(select(MessageCount))).all() == []
+    assert counter.pending(group_id=1, user_id=1, day=today) == 3
+    assert await counter.get(group_id=1, user_id=1, day=today) == 3
+
+    assert await counter.flush() == 2
+    assert counter.pending(group_id=1, user_id=1, day=today) == 0
+
+    # 已有计数时在原值上累加
+    counter.increment(group_id=1, user_id=1, day=today)
+    assert await counter.get(group_id=1, user_id=1, day=today) == 4
+    assert await counter.flush() == 1
+
+    async with create_session() as session:
+        counts = (
+            await session.scalars(select(MessageCount).order_by(MessageCount.user_id))
+        ).all()
+        assert [(count.user_id, count.count) for count in counts] == [(1, 4), (2, 1)]
+
+    assert await counter.get(group_id=2, user_id=1, day=today) == 0
+    assert await counter.flush() == 0
+
+    with pytest.raises(ValueError, match="计数的键应为 group_id, user_id, day"):
+        counter.increment(group_id=1)
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_counter_flush_interval": 0.01}, id="interval")],
+    indirect=True,
+)
+async def test_counter_flush(app: App):
+    """测试定时写入与关闭时写入"""
+    import asyncio
+
+    from nonebot_plugin_datastore.counter import flush_counters
+    from nonebot_plugin_datastore.db import init_db
+
+    require("tests.example.counter")
+    from .example.counter import counter
+
+    await init_db()
+
+    today = date(2024, 1, 1)
+    counter.increment(group_id=1, user_id=1, day=today)
+    await asyncio.sleep(0.05)
+    assert counter.pending(group_id=1, user_id=1, day=today) == 0
+    assert await counter.get(group_id=1, user_id=1, day=today) == 1
+
+    counter.increment(group_id=1, user_id=1, day=today)
+    await flush_counters()
+    assert counter.pending(group_id=1, user_id=1, day=today) == 0
+    assert await counter.get(group_id=1, user_id=1, day=today) == 2
+
+
+async def test_counter_lock(app: App):
+    """测试计数器的锁不会绑定到其他事件循环"""
+    import asyncio
+
+    from nonebot_plugin_datastore.db import init_db
+
+    require("tests.example.counter")
+    from .example.counter import counter
+
+    await init_db()
+
+    def contend() -> None:
+        """在另一个事件循环中争用锁，让锁绑定到该事件循环"""
+
+        async def main() -> None:
+            lock = counter._get_lock()
+            async with lock:
+                waiter = asyncio.create_task(lock.acquire())
+                await asyncio.sleep(0)
+            await waiter
+            lock.release()
+
+        asyncio.run(main())
+
+    await asyncio.to_thread(contend)
+
+    today = date(2024, 1, 1)
+    counter.increment(group_id=1, user_id=1, day=today)
+    # 写入时获取计数需要等待锁
+    _, first, second = await asyncio.gather(
+        counter.flush(),
+        counter.get(group_id=1, user_id=1, day=today),
+        counter.get(group_id=1, user_id=1, day=today),
+    )
+    assert first == second == 1
+
+
+async def test_counter_get_during_flush(app: App, mocker: MockerFixture):
+    """测试获取计数时不持有锁，查询期间写入也不会重复计算"""
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    from nonebot_plugin_datastore.db import init_db
+
+    require("tests.example.counter")
+    from .example.counter import counter
+
+    await init_db()
+
+    today = date(2024, 1, 1)
+    counter.increment(group_id=1, user_id=1, day=today)
+
+    get = AsyncSession.get
+    locked = []
+
+    async def get_and_flush(self, *args, **kwargs):
+        locked.append(counter._get_lock().locked())
+        # 第一次查询时写入计数，持有锁时会死锁
+        if len(locked) == 1:
+            await counter.flush()
+        return await get(self, *args, **kwargs)
+
+    mocker.patch.object(AsyncSession, "get", get_and_flush)
+
+    assert await counter.get(group_id=1, user_id=1, day=today) == 1
+    assert locked == [False, False]
+    assert counter.pending(group_id=1, user_id=1, day=today) == 0
@@ -3,6 +3,7 @@ from pathlib import Path
 import pytest
 from nonebot import require
 from nonebug import App
+from pytest_mock import MockerFixture
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
@@ -63,6 +64,20 @@ async def test_disable_db(app: App):
         create_session()
 
 
+async def test_lazy_engine(app: App):
+    """测试没有插件使用数据库时不创建数据库引擎"""
+    from nonebot_plugin_datastore.db import get_engine, get_engines, init_db
+
+    assert get_engines() == {}
+
+    await init_db()
+    assert get_engines() == {}
+
+    engine = get_engine()
+    assert get_engines() == {"default": engine}
+    assert get_engine() is engine
+
+
 async def test_default_db_url(nonebug_init: None):
     """测试默认数据库地址"""
     import nonebot
@@ -91,6 +106,88 @@ async def test_post_db_init_error(app: App):
     await init_db()
 
 
+async def test_post_db_init_order(app: App):
+    """数据库初始化后执行的函数按依赖顺序执行"""
+    from nonebot_plugin_datastore.db import post_db_init, run_post_db_init_funcs
+
+    order = []
+
+    @post_db_init
+    async def first():
+        order.append("first")
+
+    @post_db_init(depends_on=[first])
+    def second():
+        order.append("second")
+
+    @post_db_init(depends_on=[second])
+    async def error():
+        raise Exception("test")
+
+    @post_db_init(depends_on=[error])
+    async def skipped():
+        order.append("skipped")  # pragma: no cover
+
+    @post_db_init
+    async def last():
+        order.append("last")
+
+    durations = await run_post_db_init_funcs()
+
+    assert order == ["first", "last", "second"]
+    assert {name.rsplit(".", 1)[-1] for name in durations} == {
+        "first",
+        "second",
+        "error",
+        "last",
+    }
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_post_db_init_concurrency": 2}, id="concurrency")],
+    indirect=True,
+)
+async def test_post_db_init_concurrency(app: App):
+    """同时执行数据库初始化后执行的函数"""
+    import asyncio
+
+    from nonebot_plugin_datastore.db import post_db_init, run_post_db_init_funcs
+
+    running = 0
+    max_running = 0
+    order = []
+
+    async def _work(name: str):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        order.append(name)
+        running -= 1
+
+    @post_db_init
+    async def slow1():
+        await _work("slow1")
+
+    @post_db_init
+    async def slow2():
+        await _work("slow2")
+
+    @post_db_init
+    async def slow3():
+        await _work("slow3")
+
+    @post_db_init(depends_on=[slow1, slow2, slow3])
+    async def after():
+        await _work("after")
+
+    await run_post_db_init_funcs()
+
+    assert max_running == 2
+    assert order[-1] == "after"
+
+
 async def test_pre_db_init_error(app: App):
     """数据库初始化前执行函数错误"""
     from nonebot_plugin_datastore.db import init_db
@@ -161,3 +258,844 @@ async def test_create_db(app: App):
 
     database_path.unlink()
     database_path.parent.rmdir()
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_migration_concurrency": 4}, id="concurrency")],
+    indirect=True,
+)
+async def test_init_db_concurrency(app: App, mocker: MockerFixture):
+    """测试同时初始化多个插件的数据库"""
+    import asyncio
+    import time
+
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore import db
+    from nonebot_plugin_datastore.db import create_session, init_plugins_db
+    from nonebot_plugin_datastore.profile import StartupProfile
+    from nonebot_plugin_datastore.script import command
+
+    require("tests.example.plugin1")
+    require("tests.example.plugin_migrate")
+    from .example.plugin1 import Example
+
+    calls = []
+
+    async def run_pre_db_init_funcs(plugin: str) -> None:
+        calls.append(("start", plugin))
+        await asyncio.sleep(0.05)
+        calls.append(("end", plugin))
+
+    mocker.patch.object(db, "run_pre_db_init_funcs", run_pre_db_init_funcs)
+
+    upgrade = command.upgrade
+
+    async def slow_upgrade(*args, **kwargs):
+        await asyncio.sleep(0.1)
+        await upgrade(*args, **kwargs)
+
+    mocker.patch.object(command, "upgrade", slow_upgrade)
+
+    profile = StartupProfile()
+    start = time.perf_counter()
+    durations = await init_plugins_db(["plugin1", "plugin_migrate"], profile)
+    elapsed = time.perf_counter() - start
+    assert set(durations) == {"plugin1", "plugin_migrate"}
+    # 使用 SQLite 时 pre_db_init 也会同时执行
+    assert calls[:2] == [("start", "plugin1"), ("start", "plugin_migrate")]
+
+    # 升级逐个进行，后升级的插件需要等待
+    assert max(plugin.phases["lock_wait"] for plugin in profile.plugins.values()) > 0.09
+    # 总耗时不包括等待其他插件升级的时间，所以各插件升级的耗时之和不超过实际耗时
+    for name, plugin in profile.plugins.items():
+        assert plugin.total == durations[name]
+    assert (
+        sum(
+            plugin.total - plugin.phases["pre_db_init"]
+            for plugin in profile.plugins.values()
+        )
+        <= elapsed
+    )
+
+    async with create_session() as session:
+        examples = (await session.scalars(select(Example))).all()
+        assert examples == []
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_migration_concurrency": 4}, id="concurrency")],
+    indirect=True,
+)
+async def test_init_db_concurrency_error(app: App, mocker: MockerFixture):
+    """测试同时初始化时插件初始化失败"""
+    from nonebot_plugin_datastore.db import init_plugins_db
+
+    require("tests.example.plugin1")
+    require("tests.example.pre_db_init_error")
+
+    with pytest.raises(OperationalError):
+        await init_plugins_db(["plugin1", "pre_db_init_error"])
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_migration_fast_path": True}, id="fast_path")],
+    indirect=True,
+)
+async def test_init_db_fast_path(app: App, mocker: MockerFixture, tmp_path: Path):
+    """测试跳过数据库已是最新版本的插件"""
+    import os
+    import shutil
+
+    from alembic.script import ScriptDirectory
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.db import init_db
+    from nonebot_plugin_datastore.script import command
+
+    require("tests.example.plugin1")
+
+    migration_dir = tmp_path / "migrations"
+    shutil.copytree(
+        Path(__file__).parent / "example" / "plugin1" / "migrations",
+        migration_dir,
+    )
+    PluginData("plugin1").set_migration_dir(migration_dir)
+
+    upgrade = mocker.spy(command, "upgrade")
+    from_config = mocker.spy(ScriptDirectory, "from_config")
+
+    await init_db()
+    assert upgrade.call_count == 1
+
+    # 数据库已是最新版本，且迁移文件未变化
+    from_config.reset_mock()
+    await init_db()
+    assert upgrade.call_count == 1
+    from_config.assert_not_called()
+
+    # 迁移文件变化后需要重新获取最新版本
+    revision_file = next(migration_dir.glob("*.py"))
+    stat = revision_file.stat()
+    os.utime(revision_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    await init_db()
+    assert upgrade.call_count == 1
+    from_config.assert_called_once()
+
+
+async def test_outdated_plugins_with_pre_db_init(app: App):
+    """测试有 pre_db_init 函数的插件始终需要初始化"""
+    from nonebot_plugin_datastore.db import get_outdated_plugins, init_plugins_db
+
+    require("tests.example.plugin1")
+    require("tests.example.pre_db_init_error")
+
+    assert await get_outdated_plugins(["plugin1", "pre_db_init_error"]) == [
+        "plugin1",
+        "pre_db_init_error",
+    ]
+
+    await init_plugins_db(["plugin1"])
+
+    assert await get_outdated_plugins(["plugin1", "pre_db_init_error"]) == [
+        "pre_db_init_error"
+    ]
+
+
+async def test_head_revisions_cache_write_error(app: App, mocker: MockerFixture):
+    """测试无法写入最新版本缓存时仍能获取最新版本"""
+    from nonebot_plugin_datastore.script.utils import get_head_revisions
+
+    require("tests.example.plugin1")
+
+    mocker.patch.object(Path, "write_text", side_effect=OSError("read-only"))
+
+    assert get_head_revisions(["plugin1"]) == {"plugin1": {"b6475c9488b6"}}
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {
+                "datastore_plugin_database_urls": {"plugin1": "plugin1/plugin1.db"},
+                "datastore_config_provider": "~database",
+            },
+            id="plugin_url",
+        )
+    ],
+    indirect=True,
+)
+async def test_plugin_database_url(app: App):
+    """测试插件单独使用数据库"""
+    import sqlite3
+
+    from sqlalchemy import insert, select
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.config import plugin_config
+    from nonebot_plugin_datastore.db import create_session, get_engine, init_db
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    plugin1_db = plugin_config.datastore_data_dir / "plugin1" / "plugin1.db"
+    assert plugin_config.datastore_plugin_database_urls == {
+        "plugin1": f"sqlite+aiosqlite:///{plugin1_db}"
+    }
+    assert get_engine("plugin1") is not get_engine()
+    assert get_engine("nonebot_plugin_datastore") is get_engine()
+
+    await init_db()
+
+    # 数据库配置使用默认的数据库
+    await PluginData("test").config.set("test", 1)
+
+    async with create_session() as session:
+        await session.execute(insert(Example).values(message="insert"))
+        await session.commit()
+
+        examples = (await session.scalars(select(Example))).all()
+        assert [example.message for example in examples] == ["post", "insert"]
+
+    with sqlite3.connect(plugin1_db) as connection:
+        tables = {
+            name
+            for (name,) in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            )
+        }
+    assert tables == {"plugin1_alembic_version", "plugin1_example"}
+
+    main_db = plugin_config.datastore_data_dir / "data.db"
+    with sqlite3.connect(main_db) as connection:
+        tables = {
+            name
+            for (name,) in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            )
+        }
+    assert "plugin1_example" not in tables
+    assert "nonebot_plugin_datastore_configmodel" in tables
+
+
+async def test_read_database_url(app: App, mocker: MockerFixture, tmp_path: Path):
+    """测试只读数据库"""
+    import shutil
+
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore.config import plugin_config
+    from nonebot_plugin_datastore.db import create_session, get_read_engine, init_db
+
+    replica = tmp_path / "replica.db"
+    read_url = f"sqlite+aiosqlite:///{replica}"
+    mocker.patch.object(plugin_config, "datastore_read_database_url", read_url)
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example, count
+
+    await init_db()
+
+    # 使用复制的数据库文件模拟只读数据库
+    shutil.copy(plugin_config.datastore_data_dir / "data.db", replica)
+    try:
+        assert str(get_read_engine().url) == read_url
+
+        async with create_session() as session:
+            session.add(Example(message="primary"))
+            await session.commit()
+
+        async with create_session(readonly=True) as session:
+            examples = (await session.scalars(select(Example))).all()
+            assert [example.message for example in examples] == ["post"]
+
+        message = make_fake_message()("/count")
+        event = make_fake_event(_message=message)()
+
+        async with app.test_matcher(count) as ctx:
+            bot = ctx.create_bot()
+            ctx.receive_event(bot, event)
+            ctx.should_call_send(event, "1", True)
+            ctx.should_finished()
+    finally:
+        await get_read_engine().dispose()
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_background_migration": True}, id="background")],
+    indirect=True,
+)
+async def test_background_migration(app: App, mocker: MockerFixture):
+    """测试在后台初始化数据库"""
+    import asyncio
+
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore.db import (
+        create_session,
+        get_plugins_readiness,
+        init_db,
+        is_plugin_ready,
+        wait_plugin_ready,
+    )
+    from nonebot_plugin_datastore.script import command
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    upgrade = command.upgrade
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_upgrade(*args, **kwargs):
+        started.set()
+        await release.wait()
+        await upgrade(*args, **kwargs)
+
+    mocker.patch.object(command, "upgrade", slow_upgrade)
+
+    await init_db()
+    await started.wait()
+    assert get_plugins_readiness() == {"plugin1": False}
+    assert not is_plugin_ready("plugin1")
+    # 没有使用数据库的插件始终就绪
+    assert is_plugin_ready("plugin2")
+
+    async def query():
+        async with create_session() as session:
+            return (await session.scalars(select(Example))).all()
+
+    task = asyncio.create_task(query())
+    await asyncio.sleep(0.01)
+    assert not task.done()
+
+    release.set()
+    await wait_plugin_ready("plugin1")
+    assert is_plugin_ready("plugin1")
+    # 迁移完成后查询才会执行，此时 post_db_init 可能还未写入数据
+    assert len(await task) <= 1
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_background_migration": True}, id="background")],
+    indirect=True,
+)
+async def test_background_migration_error(app: App):
+    """测试后台初始化数据库失败"""
+    from nonebot_plugin_datastore.db import (
+        create_session,
+        get_plugins_readiness,
+        init_db,
+        wait_plugin_ready,
+    )
+
+    require("tests.example.pre_db_init_error")
+    from .example.pre_db_init_error import Example
+
+    await init_db()
+
+    with pytest.raises(RuntimeError, match="插件 pre_db_init_error 的数据库初始化失败"):
+        await wait_plugin_ready("pre_db_init_error")
+    assert get_plugins_readiness() == {"pre_db_init_error": False}
+
+    with pytest.raises(RuntimeError, match="数据库初始化失败"):
+        async with create_session() as session:
+            await session.get(Example, 1)
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_background_migration": True}, id="background")],
+    indirect=True,
+)
+async def test_background_migration_cancelled(app: App, mocker: MockerFixture):
+    """测试取消后台初始化数据库时，等待中的查询不会一直等待"""
+    import asyncio
+
+    from nonebot_plugin_datastore import db
+    from nonebot_plugin_datastore.db import create_session, init_db, is_plugin_ready
+    from nonebot_plugin_datastore.script import command
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    started = asyncio.Event()
+
+    async def blocked_upgrade(*args, **kwargs):
+        started.set()
+        await asyncio.Event().wait()
+
+    mocker.patch.object(command, "upgrade", blocked_upgrade)
+
+    await init_db()
+    await started.wait()
+
+    async def query():
+        async with create_session() as session:
+            await session.get(Example, 1)
+
+    task = asyncio.create_task(query())
+    await asyncio.sleep(0.01)
+    assert not task.done()
+
+    assert db._migration_task
+    db._migration_task.cancel()
+    with pytest.raises(RuntimeError, match="插件 plugin1 的数据库初始化失败"):
+        await asyncio.wait_for(task, 1)
+    assert not is_plugin_ready("plugin1")
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {
+                "datastore_warmup": True,
+                "datastore_warmup_connections": 2,
+                "datastore_engine_options": {"poolclass": AsyncAdaptedQueuePool},
+            },
+            id="warmup",
+        )
+    ],
+    indirect=True,
+)
+async def test_warmup(app: App):
+    """测试预热数据库"""
+    from sqlalchemy import inspect
+
+    from nonebot_plugin_datastore.db import get_engine, init_db
+    from nonebot_plugin_datastore.profile import get_last_profile
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    assert inspect(Example).configured
+    assert get_engine().sync_engine.pool.checkedin() == 2  # type: ignore
+
+    profile = get_last_profile()
+    assert profile
+    assert "warmup" in profile.phases
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {
+                "datastore_warmup": True,
+                "datastore_engine_options": {"poolclass": NullPool},
+            },
+            id="null_pool",
+        )
+    ],
+    indirect=True,
+)
+async def test_warmup_null_pool(app: App):
+    """测试连接池不保留连接时不预先打开连接"""
+    from nonebot_plugin_datastore.db import _warmup_engine, get_engine
+
+    assert await _warmup_engine(get_engine(), 2) == 0
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {
+                "datastore_sqlite_profile": "performance",
+                # 连接池保留连接时，WAL 文件不会在连接关闭时清空
+                "datastore_engine_options": {"poolclass": AsyncAdaptedQueuePool},
+            },
+            id="wal",
+        )
+    ],
+    indirect=True,
+)
+async def test_shutdown_db(app: App, mocker: MockerFixture):
+    """测试关闭数据库"""
+    from datetime import date
+
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore import db
+    from nonebot_plugin_datastore.config import plugin_config
+    from nonebot_plugin_datastore.db import (
+        create_session,
+        get_engines,
+        init_db,
+        shutdown_db,
+    )
+
+    require("tests.example.counter")
+    from .example.counter import MessageCount, counter
+
+    await init_db()
+
+    today = date(2024, 1, 1)
+    counter.increment(group_id=1, user_id=1, day=today)
+
+    wal_file = plugin_config.datastore_data_dir / "data.db-wal"
+    assert wal_file.stat().st_size > 0
+
+    checkpoint = mocker.spy(db, "_checkpoint_sqlite")
+    await shutdown_db()
+
+    checkpoint.assert_called_once()
+    assert get_engines() == {}
+    # 最后一个连接关闭后 SQLite 会删除 WAL 文件
+    assert not wal_file.exists() or wal_file.stat().st_size == 0
+    assert counter.pending(group_id=1, user_id=1, day=today) == 0
+
+    # 之后使用时重新创建数据库引擎
+    async with create_session() as session:
+        count = (await session.scalars(select(MessageCount))).one()
+        assert count.count == 1
+
+    await shutdown_db()
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_background_migration": True}, id="background")],
+    indirect=True,
+)
+async def test_shutdown_db_background_migration(app: App, mocker: MockerFixture):
+    """测试关闭数据库时等待后台迁移取消完成"""
+    import asyncio
+
+    from nonebot_plugin_datastore import db
+    from nonebot_plugin_datastore.db import get_engines, init_db, shutdown_db
+    from nonebot_plugin_datastore.script import command
+
+    require("tests.example.plugin1")
+
+    started = asyncio.Event()
+    engines_at_cleanup = []
+
+    async def blocked_upgrade(*args, **kwargs):
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # 模拟取消后仍需要使用连接的清理
+            await asyncio.sleep(0.05)
+            engines_at_cleanup.append(bool(get_engines()))
+
+    mocker.patch.object(command, "upgrade", blocked_upgrade)
+
+    await init_db()
+    await started.wait()
+
+    await shutdown_db()
+
+    assert db._migration_task
+    assert db._migration_task.done()
+    # 迁移完成清理之后才释放数据库引擎
+    assert engines_at_cleanup == [True]
+    assert get_engines() == {}
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_shutdown_timeout": 0.1}, id="timeout")],
+    indirect=True,
+)
+async def test_shutdown_db_timeout(app: App, mocker: MockerFixture):
+    """测试关闭数据库时等待事务完成"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore.db import (
+        _wait_active_sessions,
+        create_session,
+        init_db,
+        shutdown_db,
+    )
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    session = create_session()
+    await session.scalars(select(Example))
+    assert await _wait_active_sessions(0.1) == 1
+
+    await session.commit()
+    assert await _wait_active_sessions(0.1) == 0
+
+    await session.scalars(select(Example))
+    warning = mocker.patch("nonebot_plugin_datastore.db.logger.warning")
+    await shutdown_db()
+    warning.assert_called_once_with("等待 0.1s 后仍有 1 个事务未完成")
+    await session.close()
+
+
+async def test_event_session(app: App, mocker: MockerFixture):
+    """测试同一个事件共享 session"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore import db
+    from nonebot_plugin_datastore.db import create_session, get_event_session, init_db
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example, event_add, event_count
+
+    await init_db()
+
+    create = mocker.spy(db, "EventSession")
+
+    async with app.test_matcher([event_add, event_count]) as ctx:
+        bot = ctx.create_bot()
+        event = make_fake_event(_message=make_fake_message()("/event"))()
+        ctx.receive_event(bot, event)
+        ctx.should_call_send(event, "2", True)
+
+    create.assert_called_once()
+    assert db._event_sessions == {}
+
+    # 事件响应器出现异常时回滚
+    event = make_fake_event()()
+    session = await get_event_session(event)
+    assert await get_event_session(event) is session
+    session.add(Example(message="error"))
+    await db._mark_event_session_failed(event, ValueError("error"))
+    await db._close_event_session(event)
+
+    assert db._event_sessions == {}
+    assert db._failed_events == set()
+
+    async with create_session() as session:
+        messages = (await session.scalars(select(Example.message))).all()
+        assert messages == ["post", "event"]
+
+
+async def test_event_session_same_priority(app: App):
+    """测试同时运行的事件响应器共用 session"""
+    from sqlalchemy import func, select
+
+    from nonebot_plugin_datastore import db
+    from nonebot_plugin_datastore.db import create_session, init_db
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example, event_same_first, event_same_second
+
+    await init_db()
+
+    async with app.test_matcher([event_same_first, event_same_second]) as ctx:
+        bot = ctx.create_bot()
+        event = make_fake_event(_message=make_fake_message()("/event_same"))()
+        ctx.receive_event(bot, event)
+
+    assert db._event_sessions == {}
+    assert db._failed_events == set()
+
+    async with create_session() as session:
+        count = await session.scalar(
+            select(func.count()).select_from(Example).where(Example.message == "same")
+        )
+        assert count == 10
+
+
+async def _count_reload_selects(expire_on_commit: bool) -> int:
+    """提交后读取对象属性时执行的查询数"""
+    from sqlalchemy import event
+
+    from nonebot_plugin_datastore.db import create_session, get_engine
+
+    from .example.plugin1 import Example
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if statement.startswith("SELECT"):
+            statements.append(statement)
+
+    engine = get_engine().sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        async with create_session() as session:
+            assert session.sync_session.expire_on_commit is expire_on_commit
+            examples = [Example(message=str(i)) for i in range(10)]
+            session.add_all(examples)
+            await session.commit()
+            await session.run_sync(lambda _: [example.message for example in examples])
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+
+async def test_session_options_default(app: App):
+    """测试默认的 session 选项，提交后读取对象属性需要重新查询"""
+    from nonebot_plugin_datastore.db import init_db
+
+    require("tests.example.plugin1")
+
+    await init_db()
+
+    assert await _count_reload_selects(True) == 10
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {
+                "datastore_session_options": {
+                    "expire_on_commit": False,
+                    "info": {"global": True},
+                },
+                "datastore_plugin_session_options": {
+                    "plugin1": {"info": {"plugin": "plugin1"}}
+                },
+            },
+            id="session_options",
+        )
+    ],
+    indirect=True,
+)
+async def test_session_options(app: App):
+    """测试设置 session 选项"""
+    from nonebot_plugin_datastore.db import (
+        create_session,
+        get_session_options,
+        get_sessionmaker,
+        init_db,
+    )
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import session_info
+
+    await init_db()
+
+    # 提交后不再需要重新查询
+    assert await _count_reload_selects(False) == 0
+
+    # 插件单独设置的选项会覆盖全局选项
+    assert get_session_options("plugin1") == {
+        "expire_on_commit": False,
+        "info": {"plugin": "plugin1"},
+    }
+    assert get_sessionmaker(plugin="plugin1") is get_sessionmaker(plugin="plugin1")
+
+    async with create_session() as session:
+        assert session.info == {"global": True}
+        session.info["changed"] = True
+
+    # 每个 session 的 info 互不影响
+    async with create_session() as session:
+        assert session.info == {"global": True}
+
+    async with app.test_matcher(session_info) as ctx:
+        bot = ctx.create_bot()
+        event = make_fake_event(_message=make_fake_message()("/session_info"))()
+        ctx.receive_event(bot, event)
+        ctx.should_call_send(event, "{'plugin': 'plugin1'}", True)
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_session_options": {"bind": None}}, id="invalid")],
+    indirect=True,
+)
+async def test_session_options_invalid(app: App):
+    """测试不支持的 session 选项"""
+    from nonebot_plugin_datastore.db import create_session
+
+    with pytest.raises(ValueError, match="不支持的 session 选项: bind"):
+        create_session()
+
+
+async def _get_table_names() -> list[str]:
+    from sqlalchemy import inspect
+
+    from nonebot_plugin_datastore.db import get_engine
+
+    async with get_engine().connect() as connection:
+        return await connection.run_sync(lambda conn: inspect(conn).get_table_names())
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_migration_batch": "transaction"}, id="transaction")],
+    indirect=True,
+)
+async def test_init_db_batch(app: App):
+    """测试在同一个连接中初始化插件的数据库"""
+    from sqlalchemy import event
+
+    from nonebot_plugin_datastore.db import get_engine, init_plugins_db
+
+    require("tests.example.plugin1")
+    require("tests.example.plugin_migrate")
+
+    connections = []
+    event.listen(get_engine().sync_engine, "engine_connect", connections.append)
+
+    durations = await init_plugins_db(["plugin1", "plugin_migrate"])
+    assert set(durations) == {"plugin1", "plugin_migrate"}
+    assert len(connections) == 1
+
+    tables = await _get_table_names()
+    assert "plugin1_alembic_version" in tables
+    assert "plugin_migrate_alembic_version" in tables
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param({"datastore_migration_batch": "transaction"}, id="transaction"),
+        pytest.param({"datastore_migration_batch": "savepoint"}, id="savepoint"),
+    ],
+    indirect=True,
+)
+async def test_init_db_batch_error(app: App, mocker: MockerFixture):
+    """测试在同一个连接中初始化时插件初始化失败"""
+    from nonebot_plugin_datastore.config import plugin_config
+    from nonebot_plugin_datastore.db import init_plugins_db
+    from nonebot_plugin_datastore.script import command
+
+    require("tests.example.plugin1")
+    require("tests.example.plugin_migrate")
+
+    upgrade = command.upgrade
+
+    async def _upgrade(config, revision, *args, **kwargs):
+        await upgrade(config, revision, *args, **kwargs)
+        if config.get_main_option("plugin_name") == "plugin_migrate":
+            raise ValueError("migration error")
+
+    mocker.patch.object(command, "upgrade", _upgrade)
+
+    with pytest.raises(ValueError, match="migration error"):
+        await init_plugins_db(["plugin1", "plugin_migrate"])
+
+    tables = await _get_table_names()
+    assert "plugin_migrate_alembic_version" not in tables
+    if plugin_config.datastore_migration_batch == "transaction":
+        # 所有插件的迁移都被回滚
+        assert "plugin1_alembic_version" not in tables
+        assert "plugin1_example" not in tables
+    else:
+        # 只回滚失败的插件
+        assert "plugin1_alembic_version" in tables
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_migration_batch": "unknown"}, id="unknown")],
+    indirect=True,
+)
+async def test_init_db_batch_unknown(app: App):
+    """测试未知的批量迁移方式"""
+    from nonebot_plugin_datastore.db import init_plugins_db
+
+    with pytest.raises(ValueError, match="未知的批量迁移方式: unknown"):
+        await init_plugins_db([])
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+from nonebot import require
+from nonebug import App
+
+
+async def test_group_commit(app: App):
+    """测试合并提交"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore.db import create_session, init_db
+    from nonebot_plugin_datastore.group_commit import GroupCommitter
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    committer = GroupCommitter(interval=60, max_operations=3)
+
+    def add(message: str):
+        async def _add(session):
+            example = Example(message=message)
+            session.add(example)
+            await session.flush()
+            return example.id
+
+        return _add
+
+    # 达到最大操作数后立即提交
+    ids = await asyncio.gather(*(committer.submit(add(f"batch{i}")) for i in range(3)))
+    assert ids == [2, 3, 4]
+    assert committer.batches == 1
+    assert committer.operations == 3
+
+    # 未达到最大操作数时，关闭时提交
+    task = asyncio.create_task(committer.submit(add("close")))
+    await asyncio.sleep(0)
+    assert not task.done()
+    await committer.close()
+    assert await task == 5
+    assert committer.batches == 2
+
+    async with create_session() as session:
+        messages = (await session.scalars(select(Example.message))).all()
+        assert messages == ["post", "batch0", "batch1", "batch2", "close"]
+
+
+async def test_group_commit_interval(app: App):
+    """测试等待一段时间后提交"""
+    from nonebot_plugin_datastore.db import init_db
+    from nonebot_plugin_datastore.group_commit import GroupCommitter
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    committer = GroupCommitter(interval=0.01)
+
+    async def add(session):
+        session.add(Example(message="interval"))
+
+    await asyncio.wait_for(
+        asyncio.gather(committer.submit(add), committer.submit(add)), 1
+    )
+    assert committer.batches == 1
+    assert committer.operations == 2
+
+
+async def test_group_commit_fallback(app: App):
+    """测试合并提交失败后逐个执行"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore.db import create_session, init_db
+    from nonebot_plugin_datastore.group_commit import GroupCommitter
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    committer = GroupCommitter(interval=60, max_operations=3)
+
+    async def add(session):
+        session.add(Example(message="fallback"))
+
+    async def error(session):
+        raise ValueError("error")
+
+    results = await asyncio.gather(
+        committer.submit(add),
+        committer.submit(error),
+        committer.submit(add),
+        return_exceptions=True,
+    )
+    assert results[0] is None
+    assert isinstance(results[1], ValueError)
+    assert results[2] is None
+    assert committer.fallbacks == 1
+    assert committer.operations == 2
+
+    async with create_session() as session:
+        messages = (await session.scalars(select(Example.message))).all()
+        assert messages == ["post", "fallback", "fallback"]
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_group_commit_max_operations": 2}, id="config")],
+    indirect=True,
+)
+async def test_group_commit_default(app: App):
+    """测试默认的合并提交器"""
+    from nonebot_plugin_datastore.db import init_db
+    from nonebot_plugin_datastore.group_commit import (
+        close_group_committer,
+        get_group_committer,
+        group_commit,
+    )
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    async def add(session):
+        session.add(Example(message="default"))
+
+    committer = get_group_committer()
+    assert committer.max_operations == 2
+
+    await asyncio.gather(group_commit(add), group_commit(add))
+    assert committer.batches == 1
+
+    await close_group_committer()
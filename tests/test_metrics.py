@@ -0,0 +1,58 @@
+import pytest
+from click.testing import CliRunner
+from nonebug import App
+
+
+@pytest.mark.anyio()
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_enable_metrics": True}, id="metrics")],
+    indirect=True,
+)
+async def test_metrics(app: App):
+    """测试数据库指标"""
+    from nonebot import require
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore.db import create_session, init_db
+    from nonebot_plugin_datastore.metrics import get_metrics, stop_metrics_dump
+    from nonebot_plugin_datastore.script.cli import cli, run_sync
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    async with create_session() as session:
+        await session.scalars(select(Example))
+
+    metrics = get_metrics()
+    assert set(metrics) == {"default"}
+
+    default = metrics["default"]
+    assert default["queries"] > 0
+    assert default["errors"] == 0
+    assert default["query_latency"]["count"] == default["queries"]
+    assert default["query_latency"]["buckets"]["le_inf"] == default["queries"]
+    assert default["checkouts"] > 0
+    assert default["checkouts"] == default["checkins"]
+    assert default["active_connections"] == 0
+    assert default["checkout_wait"]["count"] == default["checkouts"]
+
+    runner = CliRunner()
+    result = await run_sync(runner.invoke)(cli, ["metrics"])
+    assert result.exit_code == 1
+    assert "未找到指标数据" in result.output
+
+    await stop_metrics_dump()
+
+    result = await run_sync(runner.invoke)(cli, ["metrics"])
+    assert result.exit_code == 0
+    assert '"queries"' in result.output
+
+
+async def test_metrics_disabled(app: App):
+    """测试默认不统计指标"""
+    from nonebot_plugin_datastore.metrics import get_metrics
+
+    assert get_metrics() == {}
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+from nonebug import App
+
+
+@pytest.mark.anyio()
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_migration_fast_path": True}, id="fast_path")],
+    indirect=True,
+)
+async def test_profile(app: App):
+    """测试数据库初始化耗时"""
+    from nonebot import require
+
+    from nonebot_plugin_datastore.db import init_db
+    from nonebot_plugin_datastore.profile import PLUGIN_PHASES, get_last_profile
+    from nonebot_plugin_datastore.script.cli import cli, run_sync
+
+    require("tests.example.plugin1")
+
+    runner = CliRunner()
+    result = await run_sync(runner.invoke)(cli, ["profile"])
+    assert result.exit_code == 1
+    assert "未找到数据库初始化耗时数据" in result.output
+
+    await init_db()
+
+    profile = get_last_profile()
+    assert profile
+    assert set(profile.phases) == {"engine", "fast_path", "post_db_init"}
+    assert list(profile.plugins) == ["plugin1"]
+
+    plugin = profile.plugins["plugin1"]
+    assert set(plugin.phases) == set(PLUGIN_PHASES)
+    assert [revision["revision"] for revision in plugin.revisions] == ["b6475c9488b6"]
+    # 等待其他插件升级的时间不计入总耗时
+    assert plugin.total >= sum(
+        duration for phase, duration in plugin.phases.items() if phase != "lock_wait"
+    )
+    assert len(profile.post_db_init) == 1
+
+    table = profile.format_table().splitlines()
+    assert table[0].split() == ["插件", "总计", *PLUGIN_PHASES]
+    assert table[1].startswith("plugin1")
+
+    result = await run_sync(runner.invoke)(cli, ["profile"])
+    assert result.exit_code == 0
+    data = json.loads(result.output)
+    assert list(data["plugins"]) == ["plugin1"]
+    assert data["plugins"]["plugin1"]["revisions"][0]["revision"] == "b6475c9488b6"
+
+    # 数据库已是最新版本时不会初始化插件
+    await init_db()
+    profile = get_last_profile()
+    assert profile
+    assert profile.plugins == {}
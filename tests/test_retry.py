@@ -0,0 +1,91 @@
+import sqlite3
+
+import pytest
+from nonebot import require
+from nonebug import App
+from pytest_mock import MockerFixture
+from sqlalchemy.exc import OperationalError
+
+
+def make_error(message: str) -> OperationalError:
+    return OperationalError("INSERT", {}, sqlite3.OperationalError(message))
+
+
+async def test_run_transaction_retry(app: App, mocker: MockerFixture):
+    """测试数据库被锁定时重试事务"""
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore.db import create_session, init_db
+    from nonebot_plugin_datastore.retry import get_retry_stats, run_transaction
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    sleep = mocker.patch("asyncio.sleep")
+    before = get_retry_stats()
+    calls = 0
+
+    async def add_example(session):
+        nonlocal calls
+        calls += 1
+        session.add(Example(message=f"retry{calls}"))
+        await session.flush()
+        if calls < 3:
+            raise make_error("database is locked")
+        return calls
+
+    assert await run_transaction(add_example) == 3
+    assert sleep.call_count == 2
+
+    stats = get_retry_stats()
+    assert stats["transactions"] == before["transactions"] + 1
+    assert stats["retries"] == before["retries"] + 2
+    assert stats["give_ups"] == before["give_ups"]
+
+    # 失败的尝试都已回滚
+    async with create_session() as session:
+        messages = (await session.scalars(select(Example.message))).all()
+        assert messages == ["post", "retry3"]
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {"datastore_retry_attempts": 2, "datastore_retry_max_delay": 0},
+            id="attempts",
+        )
+    ],
+    indirect=True,
+)
+async def test_run_transaction_give_up(app: App):
+    """测试重试次数用尽后放弃，以及其他错误不会重试"""
+    from nonebot_plugin_datastore.retry import get_retry_stats, run_transaction
+
+    before = get_retry_stats()
+    calls = 0
+
+    async def locked(session):
+        nonlocal calls
+        calls += 1
+        raise make_error("database is locked")
+
+    with pytest.raises(OperationalError, match="database is locked"):
+        await run_transaction(locked)
+    assert calls == 2
+
+    async def no_such_table(session):
+        nonlocal calls
+        calls += 1
+        raise make_error("no such table: test")
+
+    calls = 0
+    with pytest.raises(OperationalError, match="no such table"):
+        await run_transaction(no_such_table)
+    assert calls == 1
+
+    stats = get_retry_stats()
+    assert stats["retries"] == before["retries"] + 1
+    assert stats["give_ups"] == before["give_ups"] + 1
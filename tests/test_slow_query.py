@@ -0,0 +1,68 @@
+import json
+
+import pytest
+from nonebug import App
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_slow_query_threshold": 0}, id="slow_query")],
+    indirect=True,
+)
+async def test_slow_query_log(app: App):
+    """测试慢查询日志"""
+    from nonebot import require
+    from sqlalchemy import select
+
+    from nonebot_plugin_datastore import PluginData
+    from nonebot_plugin_datastore.db import create_session, init_db
+    from nonebot_plugin_datastore.slow_query import SLOW_QUERY_FILENAME
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    async with create_session() as session:
+        await session.scalars(select(Example).where(Example.message == "post"))
+
+    log_file = PluginData("nonebot_plugin_datastore").data_dir / SLOW_QUERY_FILENAME
+    records = [json.loads(line) for line in log_file.read_text("utf8").splitlines()]
+
+    record = records[-1]
+    assert record["engine"] == "default"
+    assert record["plugins"] == ["plugin1"]
+    assert "FROM plugin1_example" in record["statement"]
+    assert record["parameters"] == {"type": "tuple", "length": 1}
+    assert record["duration"] >= 0
+
+    # 迁移时的版本表也能找到所属插件
+    assert any(
+        "plugin1_alembic_version" in record["statement"]
+        and record["plugins"] == ["plugin1"]
+        for record in records
+    )
+
+
+async def test_resolve_plugin_names(app: App):
+    """测试根据语句判断所属插件"""
+    from nonebot import require
+
+    from nonebot_plugin_datastore.slow_query import (
+        get_parameters_shape,
+        resolve_plugin_names,
+    )
+
+    require("tests.registry.plugin3")
+    require("tests.registry.plugin3_plugin4")
+
+    assert resolve_plugin_names(
+        "SELECT * FROM plugin3_example JOIN plugin3_plugin4_example ON 1"
+    ) == ["plugin3", "plugin3_plugin4"]
+    assert resolve_plugin_names("SELECT 1") == []
+
+    assert get_parameters_shape([{"a": 1, "b": 2}, {"a": 3, "b": 4}], True) == {
+        "executemany": True,
+        "rows": 2,
+        "row": {"type": "dict", "keys": ["a", "b"]},
+    }
@@ -0,0 +1,180 @@
+import pytest
+from click.testing import CliRunner
+from nonebug import App
+from pytest_mock import MockerFixture
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {
+                "datastore_sqlite_profile": "performance",
+                "datastore_sqlite_pragmas": {"cache_size": -2000},
+            },
+            id="performance",
+        )
+    ],
+    indirect=True,
+)
+async def test_sqlite_profile(app: App):
+    """测试 SQLite 配置方案"""
+    from nonebot_plugin_datastore.db import get_engine
+    from nonebot_plugin_datastore.sqlite import get_applied_pragmas
+
+    pragmas = await get_applied_pragmas(get_engine())
+    assert pragmas == {
+        "journal_mode": "wal",
+        "synchronous": 1,
+        "busy_timeout": 5000,
+        "cache_size": -2000,
+        "mmap_size": 268435456,
+        "temp_store": 2,
+    }
+
+
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_sqlite_profile": "performance"}, id="performance")],
+    indirect=True,
+)
+async def test_sqlite_profile_pool(app: App):
+    """测试开启配置方案后保留连接，PRAGMA 在多个 session 之间持续生效"""
+    from sqlalchemy import event, text
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    from nonebot_plugin_datastore.db import create_session, get_engine
+
+    engine = get_engine()
+    assert isinstance(engine.pool, AsyncAdaptedQueuePool)
+
+    connects = []
+    event.listen(engine.sync_engine, "connect", lambda *args: connects.append(args))
+
+    cache_sizes = []
+    for _ in range(2):
+        async with create_session() as session:
+            cache_sizes.append(await session.scalar(text("PRAGMA cache_size")))
+
+    assert cache_sizes == [-64000, -64000]
+    # 第二个 session 复用了第一个 session 的连接，没有重新连接
+    assert len(connects) == 1
+
+
+async def test_sqlite_default(app: App):
+    """测试默认不修改 SQLite 设置"""
+    from nonebot_plugin_datastore.db import get_engine
+    from nonebot_plugin_datastore.sqlite import get_applied_pragmas
+
+    pragmas = await get_applied_pragmas(get_engine())
+    assert pragmas["journal_mode"] == "delete"
+    assert pragmas["synchronous"] == 2
+
+
+async def test_sqlite_unknown_profile(app: App, mocker: MockerFixture):
+    """测试未知的 SQLite 配置方案"""
+    from nonebot_plugin_datastore.config import plugin_config
+    from nonebot_plugin_datastore.sqlite import get_sqlite_pragmas
+
+    mocker.patch.object(plugin_config, "datastore_sqlite_profile", "unknown")
+
+    with pytest.raises(ValueError, match="未知的 SQLite 配置方案"):
+        get_sqlite_pragmas()
+
+
+@pytest.mark.anyio()
+@pytest.mark.parametrize(
+    "app",
+    [pytest.param({"datastore_sqlite_profile": "performance"}, id="performance")],
+    indirect=True,
+)
+async def test_pragma_command(app: App):
+    """测试查看 PRAGMA 的命令"""
+    from nonebot_plugin_datastore.script.cli import cli, run_sync
+
+    runner = CliRunner()
+    result = await run_sync(runner.invoke)(cli, ["pragma"])
+    assert result.exit_code == 0
+    assert "journal_mode: wal" in result.output
+    assert "busy_timeout: 5000" in result.output
+
+
+@pytest.mark.parametrize(
+    "app",
+    [
+        pytest.param(
+            {
+                "datastore_sqlite_profile": "performance",
+                "datastore_sqlite_write_queue": True,
+            },
+            id="write_queue",
+        )
+    ],
+    indirect=True,
+)
+async def test_sqlite_write_queue(app: App):
+    """测试 SQLite 写入队列"""
+    import asyncio
+
+    from nonebot import require
+    from sqlalchemy import func, select
+
+    from nonebot_plugin_datastore.db import create_session, get_writer_engine, init_db
+    from nonebot_plugin_datastore.writer import WriterPool, get_write_queue_stats
+
+    require("tests.example.plugin1")
+    from .example.plugin1 import Example
+
+    await init_db()
+
+    writer_engine = get_writer_engine()
+    assert writer_engine
+    assert isinstance(writer_engine.pool, WriterPool)
+
+    async def write(index: int):
+        async with create_session() as session:
+            session.add(Example(message=f"write {index}"))
+            await session.commit()
+
+    await asyncio.gather(*(write(i) for i in range(10)))
+
+    stats = get_write_queue_stats()
+    # post_db_init 中也写入了一条数据
+    assert stats["count"] == 11
+    assert stats["depth"] == 0
+    assert stats["max_depth"] >= 1
+
+    async with create_session() as session:
+        count = await session.scalar(select(func.count()).select_from(Example))
+        assert count == 11
+
+        # 同一事务中写入之后可以读取到未提交的数据
+        session.add(Example(message="uncommitted"))
+        await session.flush()
+        count = await session.scalar(select(func.count()).select_from(Example))
+        assert count == 12
+        await session.rollback()
+
+        count = await session.scalar(select(func.count()).select_from(Example))
+        assert count == 11
+
+    # 同一任务中已占用写入连接时，另一个写入事务直接报错
+    async with create_session() as session:
+        session.add(Example(message="first"))
+        await session.flush()
+        with pytest.raises(RuntimeError, match="已占用写入连接"):
+            await write(0)
+        await session.commit()
+
+    # 提交后可以继续写入
+    await write(1)
+    async with create_session() as session:
+        count = await session.scalar(select(func.count()).select_from(Example))
+        assert count == 13
+
+
+async def test_sqlite_write_queue_disabled(app: App):
+    """测试默认不开启写入队列"""
+    from nonebot_plugin_datastore.db import get_writer_engine
+
+    assert get_writer_engine() is None